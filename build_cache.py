@@ -0,0 +1,105 @@
+import hashlib
+import inspect
+import json
+import os
+import sys
+
+
+
+def project_modules(module):
+	"""module and the modules of its directory it uses, directly or through each other"""
+	root = os.path.dirname(os.path.abspath(module.__file__))
+	found = {}
+	stack = [module]
+	while stack:
+		module = stack.pop()
+		if module.__name__ in found:
+			continue
+		found[module.__name__] = module
+		for value in vars(module).values():
+			dep = value if inspect.ismodule(value) else sys.modules.get(getattr(value, '__module__', None) or '')
+			dep_file = getattr(dep, '__file__', None)
+			if dep_file and os.path.dirname(os.path.abspath(dep_file)) == root:
+				stack.append(dep)
+	return found
+
+
+
+class BuildCache:
+	"""Skip the preprocessing stages whose outputs are already up to date.
+
+	A stage is a function call. Its key hashes the source of the module defining
+	the function and of every project module it uses, directly or through other
+	project modules (so editing a helper such as save_hgcn rebuilds the stages that
+	call it, and editing any function of a module rebuilds all the stages of that
+	module), the call arguments and the content of its input files or directories; the key of the
+	last successful build of every stage is kept in a JSON file next to the data.
+	A stage runs again only if its key changed or one of its outputs is missing,
+	so editing one input rebuilds that stage and, through the content of its
+	outputs, every stage downstream of it. File digests are memoized on size and
+	modification time so unchanged inputs are not read again.
+	"""
+
+	def __init__(self, cache_path):
+		self.cache_path = cache_path
+		self.state = {'stages': {}, 'files': {}}
+		if os.path.exists(cache_path):
+			with open(cache_path) as in_file:
+				self.state = json.load(in_file)
+
+
+	def run(self, fn, *args, inputs=(), outputs=()):
+		"""Call fn(*args) unless outputs exist and were built from the same code, args and inputs"""
+		stage = fn.__name__ + '(' + ', '.join(repr(arg) for arg in args) + ')'
+		key = self.stage_key(fn, args, inputs)
+		if self.state['stages'].get(stage) == key and all(os.path.exists(path) for path in outputs):
+			print('up to date: ', stage)
+			self.save()
+			return False
+
+		print('building: ', stage)
+		fn(*args)
+		self.state['stages'][stage] = key
+		self.save()
+		return True
+
+
+	def stage_key(self, fn, args, inputs):
+		sha = hashlib.sha256()
+		for name, module in sorted(project_modules(sys.modules[fn.__module__]).items()):
+			sha.update(name.encode('utf-8'))
+			sha.update(inspect.getsource(module).encode('utf-8'))
+		sha.update(repr(args).encode('utf-8'))
+		for path in inputs:
+			sha.update(self.digest(path).encode('utf-8'))
+		return sha.hexdigest()
+
+
+	def digest(self, path):
+		if os.path.isdir(path):
+			file_paths = sorted(os.path.join(root, name) for root, _, files in os.walk(path) for name in files)
+			sha = hashlib.sha256()
+			for file_path in file_paths:
+				sha.update(os.path.relpath(file_path, path).encode('utf-8'))
+				sha.update(self.digest(file_path).encode('utf-8'))
+			return sha.hexdigest()
+
+		stat = os.stat(path)
+		abs_path = os.path.abspath(path)
+		memo = self.state['files'].get(abs_path)
+		if memo is not None and memo[0] == stat.st_size and memo[1] == stat.st_mtime_ns:
+			return memo[2]
+
+		sha = hashlib.sha256()
+		with open(path, 'rb') as in_file:
+			for chunk in iter(lambda: in_file.read(1 << 20), b''):
+				sha.update(chunk)
+		self.state['files'][abs_path] = [stat.st_size, stat.st_mtime_ns, sha.hexdigest()]
+		return sha.hexdigest()
+
+
+	def save(self):
+		tmp_path = self.cache_path + '.tmp'
+		with open(tmp_path, 'w') as out_file:
+			json.dump(self.state, out_file, indent=1)
+		os.replace(tmp_path, self.cache_path)
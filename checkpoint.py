@@ -0,0 +1,84 @@
+import os
+import random
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import torch
+
+
+
+def to_cpu(state):
+	"""Copy of the tensors of a (nested) state dict on the host, safe from later in-place updates"""
+	if torch.is_tensor(state):
+		return state.detach().to('cpu', copy=True)
+	if isinstance(state, dict):
+		return dict([(k, to_cpu(v)) for k, v in state.items()])
+	if isinstance(state, (list, tuple)):
+		return type(state)(to_cpu(v) for v in state)
+	return state
+
+
+
+def rng_state():
+	state = {'python': random.getstate(), 'numpy': np.random.get_state(), 'torch': torch.get_rng_state()}
+	if torch.cuda.is_available():
+		state['cuda'] = torch.cuda.get_rng_state_all()
+	return state
+
+
+
+def set_rng_state(state):
+	random.setstate(state['python'])
+	np.random.set_state(state['numpy'])
+	torch.set_rng_state(state['torch'])
+	if 'cuda' in state and torch.cuda.is_available():
+		torch.cuda.set_rng_state_all(state['cuda'])
+
+
+
+class Checkpointer:
+	"""Periodic checkpoints of a training run in the file checkpoint_path.
+
+	save() copies the state to the host on the calling thread, then serializes it on
+	a background thread, so training goes on while the file is written. The file is
+	replaced atomically: an interrupted write leaves the previous checkpoint intact.
+	"""
+
+	def __init__(self, checkpoint_path, interval=10):
+		self.checkpoint_path = checkpoint_path
+		self.interval = interval
+		self.pool = ThreadPoolExecutor(1)
+		self.pending = None
+
+
+	def due(self, epoch):
+		"""Whether the state after the epoch-th epoch (counted from 1) is saved"""
+		return self.interval > 0 and epoch % self.interval == 0
+
+
+	def write(self, state):
+		os.makedirs(os.path.dirname(os.path.abspath(self.checkpoint_path)), exist_ok=True)
+		tmp_path = self.checkpoint_path + '.tmp'
+		torch.save(state, tmp_path)
+		os.replace(tmp_path, self.checkpoint_path)
+
+
+	def save(self, state):
+		# one write in flight at a time: the checkpoints land in order
+		self.wait()
+		self.pending = self.pool.submit(self.write, to_cpu(state))
+
+
+	def wait(self):
+		"""Block until the last checkpoint is on disk, raising the error of a failed write"""
+		if self.pending is not None:
+			self.pending.result()
+			self.pending = None
+
+
+	def load(self):
+		"""The last checkpoint, or None when there is none"""
+		self.wait()
+		if not os.path.exists(self.checkpoint_path):
+			return None
+		return torch.load(self.checkpoint_path, map_location='cpu', weights_only=False)
@@ -1,37 +1,91 @@
 import os
 import pickle
+import hashlib
 import numpy as np
 import pandas as pd
-from sentence_transformers import SentenceTransformer
-
-def twitter4SSEEmbeddings():
-    do_train_pkl = True
-    do_test_pkl = True
-    if(do_train_pkl):
-        current_dir = os.path.dirname(os.path.abspath(__file__))
-        train_path = os.path.join(current_dir, 'twitter_dataset', 'train.csv')
-        train = pd.read_csv(train_path, sep=',', index_col=0).drop('index',axis=1).drop('label',axis=1)
-        model = SentenceTransformer('digio/Twitter4SSE')
-        embeddings = model.encode(train['text_cleaned'])
-        path = os.path.join(current_dir, 'twitter_dataset', 'embedded_datasets', '768_dim', 'train_embeddings_768' + '.pkl')
-        
-        with open(path, "wb") as fOut:
-            pickle.dump({'userId': train['id'], 'embeddings': embeddings}, fOut, protocol=pickle.HIGHEST_PROTOCOL)
-    
-    if(do_test_pkl):
-        current_dir = os.path.dirname(os.path.abspath(__file__))
-        test_path = os.path.join(current_dir, 'twitter_dataset', 'test.csv')
-        test = pd.read_csv(test_path, sep=',', index_col=0).drop('index',axis=1).drop('label',axis=1)
-        model = SentenceTransformer('digio/Twitter4SSE')
-        embeddings = model.encode(test['text_cleaned'])
-        path = os.path.join(current_dir, 'twitter_dataset', 'embedded_datasets', '768_dim', 'test_embeddings_768' + '.pkl')
-        
-        with open(path, "wb") as fOut:
-            pickle.dump({'userId': test['id'], 'embeddings': embeddings}, fOut, protocol=pickle.HIGHEST_PROTOCOL)
+import scipy.sparse as sp
+
+def text_keys(texts):
+    return np.array([hashlib.sha256(text.encode('utf-8')).hexdigest() for text in texts], dtype='<U64')
+
+def load_encode_cache(cache_dir):
+    """Keys and vectors of every shard of an encoding cache directory"""
+    shards = [np.load(os.path.join(cache_dir, name)) for name in sorted(os.listdir(cache_dir)) if name.endswith('.npz')]
+    if not shards:
+        return np.empty(0, dtype='<U64'), None
+    return np.concatenate([shard['keys'] for shard in shards]), np.concatenate([shard['vectors'] for shard in shards])
+
+def save_encode_shard(cache_dir, keys, vectors):
+    shard_path = os.path.join(cache_dir, 'shard_' + str(len(os.listdir(cache_dir))) + '_' + keys[0][:16] + '.npz')
+    with open(shard_path + '.tmp', 'wb') as out_file:
+        np.savez(out_file, keys=keys, vectors=vectors)
+    os.replace(shard_path + '.tmp', shard_path)
+
+def encode_texts(encoder, model_id, texts, cache_dir, batch_size=64, shard_size=4096):
+    """Encode texts with encoder.encode, through an on-disk cache keyed on the text content.
+
+    Duplicate texts are encoded once and only texts missing from the cache are encoded,
+    shortest first so that the batches need little padding. Every shard_size texts the
+    new vectors are saved, so an interrupted run resumes where it stopped.
+    """
+    cache_dir = os.path.join(cache_dir, hashlib.sha256(model_id.encode('utf-8')).hexdigest()[:16])
+    os.makedirs(cache_dir, exist_ok=True)
+
+    texts = list(texts)
+    unique_keys, first, inverse = np.unique(text_keys(texts), return_index=True, return_inverse=True)
+    cached_keys, cached_vectors = load_encode_cache(cache_dir)
+
+    missing = np.flatnonzero(~np.isin(unique_keys, cached_keys))
+    missing = missing[np.argsort([len(texts[first[i]]) for i in missing], kind='stable')]
+    print('encoding', len(missing), 'of', len(unique_keys), 'distinct texts')
+    for start in range(0, len(missing), shard_size):
+        shard = missing[start: start+shard_size]
+        vectors = np.asarray(encoder.encode([texts[first[i]] for i in shard], batch_size=batch_size))
+        save_encode_shard(cache_dir, unique_keys[shard], vectors)
+
+    if len(missing):
+        cached_keys, cached_vectors = load_encode_cache(cache_dir)
+    order = np.argsort(cached_keys)
+    pos = order[np.searchsorted(cached_keys, unique_keys, sorter=order)]
+    return cached_vectors[pos][inverse.ravel()]
+
+def twitter4SSEEmbeddings(model_name_or_path='digio/Twitter4SSE', batch_size=64, encoder=None):
+    """Encode the train and test users with a sentence transformer (a hub name or a local
+    directory); encoder can stand in for it with any object exposing encode(texts, batch_size)"""
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    train_path = os.path.join(current_dir, 'twitter_dataset', 'train.csv')
+    test_path = os.path.join(current_dir, 'twitter_dataset', 'test.csv')
+    train = pd.read_csv(train_path, sep=',', index_col=0).drop('index',axis=1).drop('label',axis=1)
+    test = pd.read_csv(test_path, sep=',', index_col=0).drop('index',axis=1).drop('label',axis=1)
+
+    if encoder is None:
+        from sentence_transformers import SentenceTransformer
+        encoder = SentenceTransformer(model_name_or_path)
+    model_id = os.path.abspath(model_name_or_path) if os.path.isdir(model_name_or_path) else model_name_or_path
+
+    embedded_path = os.path.join(current_dir, 'twitter_dataset', 'embedded_datasets', '768_dim')
+    sentences = pd.concat([train['text_cleaned'], test['text_cleaned']])
+    embeddings = encode_texts(encoder, model_id, sentences, os.path.join(embedded_path, 'encode_cache'), batch_size)
+
+    path = os.path.join(embedded_path, 'train_embeddings_768' + '.pkl')
+    with open(path, "wb") as fOut:
+        pickle.dump({'userId': train['id'], 'embeddings': embeddings[:len(train)]}, fOut, protocol=pickle.HIGHEST_PROTOCOL)
+
+    path = os.path.join(embedded_path, 'test_embeddings_768' + '.pkl')
+    with open(path, "wb") as fOut:
+        pickle.dump({'userId': test['id'], 'embeddings': embeddings[len(train):]}, fOut, protocol=pickle.HIGHEST_PROTOCOL)
+
+def sentence_count_matrix(sentences, key_to_index):
+    """Sparse (sentences x vocabulary) matrix counting the in-vocabulary words of every sentence"""
+    tokens = [sentence.split(" ") for sentence in sentences]
+    lengths = np.fromiter((len(sentence) for sentence in tokens), dtype=np.int64, count=len(tokens))
+    cols = np.fromiter((key_to_index.get(word, -1) for sentence in tokens for word in sentence), dtype=np.int64, count=lengths.sum())
+    rows = np.repeat(np.arange(len(tokens)), lengths)
+    known = cols >= 0
+    # duplicate (sentence, word) entries are summed into the word count
+    return sp.csr_matrix((np.ones(known.sum()), (rows[known], cols[known])), shape=(len(tokens), len(key_to_index)))
 
 def computeW2Vembeddings(dim):
-    do_train_pkl = True
-    do_test_pkl = True
     current_dir = os.path.dirname(os.path.abspath(__file__))
 
     train_path = os.path.join(current_dir, 'twitter_dataset', 'train.csv')
@@ -39,76 +93,21 @@ def computeW2Vembeddings(dim):
     train = pd.read_csv(train_path, sep=',', index_col=0).drop('index',axis=1).drop('label',axis=1)
     test = pd.read_csv(test_path, sep=',', index_col=0).drop('index',axis=1).drop('label',axis=1)
 
-    # rifare lista per train e per test
-    train_list = []
-    train_vect = train['text_cleaned']
-
-
-    for s in train_vect:
-        train_list.append(s.split(" "))
-
-    test_list = []
-    test_vect = test['text_cleaned']
-
-    for s in test_vect:
-        test_list.append(s.split(" "))
-
-    w2v_path = os.path.join(current_dir, 'twitter_dataset', 'word2vec_models', 'word2vec_model_' + str(dim) + '.pkl')
-    
-    with open(w2v_path, "rb") as in_file:
-        w2v_model = pickle.load(in_file)
-    if do_train_pkl:
-        ##TRAIN#####################################################################
-        print('Embedding training set in '+str(dim)+' dimensions.')
-        node_train_embeddings = []
-        # per train cicliamo nella lista delle parole, embedding di tutte le parole e accumuliamo in un vettore
-        i = 0
-        for sentence in train_list:
-            #inizializzazione
-            node_embedding = np.zeros(dim)
-
-            for word in sentence:
-                #calcoliamo valore per quella parola
-                if word in list(w2v_model.wv.index_to_key):
-                    vector = w2v_model.wv[word]
-                    # sommiamo
-                    node_embedding += vector
-
-            node_train_embeddings.append(node_embedding)
-            i += 1
-            print(i)
-
-        embeddings = np.asarray(node_train_embeddings)
-
-        path = os.path.join(current_dir, 'twitter_dataset', 'embedded_datasets', str(dim)+'_dim', 'train_embeddings_' + str(dim) + '.pkl')
-        with open(path, "wb") as fOut:
-            pickle.dump({'userId': train['id'], 'embeddings': embeddings}, fOut, protocol=pickle.HIGHEST_PROTOCOL)
-        ############################################################################
-
-    if do_test_pkl:
-        ##TEST######################################################################
-        print('Embedding test set in '+str(dim)+' dimensions.')
-        node_test_embeddings = []
-        # per test cicliamo nella lista delle parole, embedding di tutte le parole e accumuliamo in un vettore
-        i = 0
-        for sentence in test_list:
-            #inizializzazione
-            node_embedding = np.zeros(dim)
-
-            for word in sentence:
-                #calcoliamo valore per quella parola
-                if word in list(w2v_model.wv.index_to_key):
-                    vector = w2v_model.wv[word]
-                    # sommiamo
-                    node_embedding += vector
-
-            node_test_embeddings.append(node_embedding)
-            i += 1
-            print(i)
-
-        embeddings = np.asarray(node_test_embeddings)
-
-        path = os.path.join(current_dir, 'twitter_dataset', 'embedded_datasets', str(dim)+'_dim', 'test_embeddings_' + str(dim) + '.pkl')
-        
-        with open(path, "wb") as fOut:
-            pickle.dump({'userId': test['id'], 'embeddings': embeddings}, fOut, protocol=pickle.HIGHEST_PROTOCOL)
\ No newline at end of file
+    from gensim.models import Word2Vec
+    w2v_path = os.path.join(current_dir, 'twitter_dataset', 'word2vec_models', 'word2vec_model_' + str(dim) + '.model')
+    w2v_model = Word2Vec.load(w2v_path)
+
+    # the embedding of a user is the sum of the vectors of its in-vocabulary words:
+    # one sparse count matrix over train and test times the word vectors gives all of them
+    print('Embedding training and test set in '+str(dim)+' dimensions.')
+    sentences = pd.concat([train['text_cleaned'], test['text_cleaned']])
+    counts = sentence_count_matrix(sentences, w2v_model.wv.key_to_index)
+    embeddings = counts.dot(w2v_model.wv.vectors.astype(np.float64))
+
+    path = os.path.join(current_dir, 'twitter_dataset', 'embedded_datasets', str(dim)+'_dim', 'train_embeddings_' + str(dim) + '.pkl')
+    with open(path, "wb") as fOut:
+        pickle.dump({'userId': train['id'], 'embeddings': embeddings[:len(train)]}, fOut, protocol=pickle.HIGHEST_PROTOCOL)
+
+    path = os.path.join(current_dir, 'twitter_dataset', 'embedded_datasets', str(dim)+'_dim', 'test_embeddings_' + str(dim) + '.pkl')
+    with open(path, "wb") as fOut:
+        pickle.dump({'userId': test['id'], 'embeddings': embeddings[len(train):]}, fOut, protocol=pickle.HIGHEST_PROTOCOL)
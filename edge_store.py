@@ -0,0 +1,72 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+
+
+# An edge store is a directory holding the src, dst and weight columns of a
+# network text file as .npy arrays sorted by weight, plus a meta.json naming the
+# size and modification time of the parsed text file. meta.json is written last,
+# so a directory without it is an interrupted build.
+META = 'meta.json'
+
+
+
+class EdgeStore:
+	"""Edges of a (src, dst[, weight]) tab-separated network file, parsed once.
+
+	The columns are memory-mapped and sorted by weight, so the edges whose weight is
+	above a threshold are a suffix of the table found by binary search.
+	"""
+
+	def __init__(self, store_path):
+		self.store_path = store_path
+		self.src = np.load(os.path.join(store_path, 'src.npy'), mmap_mode='r')
+		self.dst = np.load(os.path.join(store_path, 'dst.npy'), mmap_mode='r')
+		self.weight = np.load(os.path.join(store_path, 'weight.npy'), mmap_mode='r')
+
+
+	@classmethod
+	def open(cls, txt_path, store_path):
+		"""Load the store of txt_path, parsing the text file again only if it changed"""
+		stat = os.stat(txt_path)
+		source = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+		meta_path = os.path.join(store_path, META)
+		if os.path.exists(meta_path):
+			with open(meta_path) as in_file:
+				if json.load(in_file)['source'] == source:
+					return cls(store_path)
+		cls.build(txt_path, store_path, source)
+		return cls(store_path)
+
+
+	@staticmethod
+	def build(txt_path, store_path, source):
+		print('edge store build: ', txt_path)
+		os.makedirs(store_path, exist_ok=True)
+		if os.path.exists(os.path.join(store_path, META)):
+			os.remove(os.path.join(store_path, META))
+
+		if source['size'] == 0:
+			edges = pd.DataFrame({0: np.empty(0, dtype=np.int64), 1: np.empty(0, dtype=np.int64)})
+		else:
+			edges = pd.read_csv(txt_path, sep='\t', header=None, comment='#', dtype={0: np.int64, 1: np.int64})
+		weight = edges[2].to_numpy(dtype=np.float32) if 2 in edges else np.zeros(len(edges), dtype=np.float32)
+		order = np.argsort(weight, kind='stable')
+
+		np.save(os.path.join(store_path, 'src.npy'), edges[0].to_numpy()[order].astype(np.int32))
+		np.save(os.path.join(store_path, 'dst.npy'), edges[1].to_numpy()[order].astype(np.int32))
+		np.save(os.path.join(store_path, 'weight.npy'), weight[order])
+
+		tmp_path = os.path.join(store_path, META + '.tmp')
+		with open(tmp_path, 'w') as out_file:
+			json.dump({'source': source, 'num_edges': len(order)}, out_file)
+		os.replace(tmp_path, os.path.join(store_path, META))
+
+
+	def above(self, treshold):
+		"""(src, dst, weight) views of the edges whose weight is strictly above treshold"""
+		start = np.searchsorted(self.weight, np.float32(treshold), side='right')
+		return self.src[start:], self.dst[start:], self.weight[start:]
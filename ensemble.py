@@ -0,0 +1,114 @@
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from torch.utils.checkpoint import checkpoint
+
+from layer import output_rows, neighbor_ft, fuse_types
+from model import HGCN
+from propagation import BoundPropagation
+
+
+
+class HGCNEnsemble(BoundPropagation, nn.Module):
+	"""R independently seeded HGCN replicas trained side by side in one model.
+
+	Every parameter of the replicas is stacked along a new first dimension and the
+	hidden states of a node type are [R, N, d] tensors, so each projection is one
+	batched matmul and each adjacency product runs once, on the projections of all
+	the replicas laid side by side as an N x (R*d) matrix. The replicas stay
+	independent: summing their losses gives every replica its own gradient, and an
+	elementwise optimizer such as Adam updates them as separate optimizers would.
+	Logits are [R, N, C].
+	"""
+
+	def __init__(self, seeds, net_schema, layer_shape, label_keys, type_fusion='att', type_att_size=64, fuse_proj=False, grad_checkpoint=False, packed=False):
+		super(HGCNEnsemble, self).__init__()
+
+		# the replicas already share every adjacency product: the HGCN projection and packing layouts do not apply
+		if fuse_proj or packed:
+			raise ValueError('HGCNEnsemble does not support fuse_proj or packed')
+
+		replicas = []
+		for seed in seeds:
+			torch.manual_seed(seed)
+			replicas.append(HGCN(net_schema, layer_shape, label_keys, type_fusion, type_att_size))
+
+		self.seeds = list(seeds)
+		self.net_schema = net_schema
+		self.label_keys = label_keys
+		self.type_fusion = type_fusion
+		self.num_layers = len(layer_shape) - 2
+		self.grad_checkpoint = grad_checkpoint
+
+		# parameter 'hgc.0.hete_agg.m.W_rel.a' of every replica -> params['hgc__0__hete_agg__m__W_rel__a'] of shape [R, ...]
+		self.params = nn.ParameterDict()
+		for name, _ in replicas[0].named_parameters():
+			self.params[name.replace('.', '__')] = nn.Parameter(torch.stack([replica.get_parameter(name).data for replica in replicas]))
+
+
+	def param(self, *names):
+		return self.params['__'.join(str(name) for name in names)]
+
+
+	def register_attention_collector(self, collector):
+		if collector is not None:
+			raise ValueError('HGCNEnsemble does not record the type attention of its replicas')
+
+
+	def forward(self, ft_dict, adj_dict, prop_dict=None):
+
+		# adj_dict is either the full graph or the list of pruned blocks, one per layer
+		if isinstance(adj_dict, list):
+			adj_list = adj_dict
+		else:
+			adj_list = [adj_dict] * self.num_layers
+
+		# the input features are shared by the replicas: [N, d] until the first projection
+		if prop_dict is None and self.is_bound(ft_dict):
+			prop_dict = self.prop_dict
+
+		x_dict = ft_dict
+		for i in range(self.num_layers):
+			layer_prop = prop_dict if i == 0 else None
+			if self.grad_checkpoint and self.training:
+				x_dict = checkpoint(self.layer, i, x_dict, adj_list[i], layer_prop, use_reentrant=False)
+			else:
+				x_dict = self.layer(i, x_dict, adj_list[i], layer_prop)
+
+		logits = {}
+		embd = {}
+		for k in self.label_keys:
+			embd[k] = x_dict[k]
+			logits[k] = torch.bmm(x_dict[k], self.param('embd2class', k)) + self.param('bias', k)
+		return logits, embd
+
+
+	def layer(self, i, x_dict, adj_dict, prop_dict=None):
+		x_dict = dict([(k, self.aggregate(i, k, x_dict, adj_dict[k], prop_dict[k] if prop_dict is not None else None)) for k in self.net_schema])
+		if i < self.num_layers - 1:
+			x_dict = dict([(k, F.dropout(F.elu(x_dict[k]), 0.5, training=self.training)) for k in x_dict])
+		return x_dict
+
+
+	def aggregate(self, i, curr_k, x_dict, adj_dict, prop=None):
+		"""HeteAggregateLayer.forward of every replica, on [R, N, d] hidden states"""
+		prefix = ('hgc', i, 'hete_agg', curr_k)
+		nb_list = self.net_schema[curr_k]
+
+		self_ft = torch.matmul(x_dict[curr_k], self.param(*prefix, 'w_self'))
+		self_ft = output_rows(self_ft, adj_dict)
+
+		nb_ft_list = [self_ft]
+		for k in nb_list:
+			nb_ft_list.append(neighbor_ft(adj_dict[k], x_dict[k], self.param(*prefix, 'W_rel', k), prop=prop[k] if prop is not None else None))
+
+		att_weights = tuple(self.param(*prefix, name) for name in ('w_query', 'w_keys', 'w_att')) if self.type_fusion == 'att' and nb_list else None
+		agg_nb_ft, _ = fuse_types(nb_ft_list, self.type_fusion, att_weights, self.training)
+		return agg_nb_ft + self.param(*prefix, 'bias')
+
+
+
+def ensemble_nll_loss(log_probs, target):
+	"""Sum over the replicas of their mean nll loss, for [R, N, C] log probabilities and [N] targets"""
+	R, N, C = log_probs.shape
+	return F.nll_loss(log_probs.reshape(R * N, C), target.repeat(R), reduction='sum') / N
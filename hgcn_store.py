@@ -0,0 +1,98 @@
+import json
+import os
+
+import numpy as np
+import scipy.sparse as sp
+import torch
+
+from sparse_util import sp_tensor_2_sp_csr
+
+
+
+# A preprocessed HGCN dataset is a directory of raw .npy arrays (labels and split
+# indices, features, CSR indptr/indices/values of every relation) described by a
+# small manifest.json. The manifest is written last, so a directory without it is
+# an interrupted build.
+MANIFEST = 'manifest.json'
+
+
+
+def save_hgcn(hgcn_path, label, ft_dict, adj_dict):
+	"""Write (label, ft_dict, adj_dict) as a memory-mappable dataset directory"""
+	os.makedirs(hgcn_path, exist_ok=True)
+	if os.path.exists(os.path.join(hgcn_path, MANIFEST)):
+		os.remove(os.path.join(hgcn_path, MANIFEST))
+
+	def save_array(name, array):
+		np.save(os.path.join(hgcn_path, name), np.ascontiguousarray(array))
+		return name
+
+	manifest = {'label': {}, 'ft': {}, 'adj': {}}
+	for k in label:
+		manifest['label'][k] = [save_array('label_' + k + '_' + str(i) + '.npy', torch.as_tensor(label[k][i]).cpu().numpy()) for i in range(len(label[k]))]
+
+	for k in ft_dict:
+		manifest['ft'][k] = save_array('ft_' + k + '.npy', ft_dict[k].detach().cpu().numpy())
+
+	for k in adj_dict:
+		manifest['adj'][k] = {}
+		for kk in adj_dict[k]:
+			A = adj_dict[k][kk]
+			A = sp_tensor_2_sp_csr(A) if torch.is_tensor(A) else sp.csr_matrix(A)
+			prefix = 'adj_' + k + '_' + kk + '_'
+			manifest['adj'][k][kk] = {
+				'shape': list(A.shape),
+				'indptr': save_array(prefix + 'indptr.npy', A.indptr),
+				'indices': save_array(prefix + 'indices.npy', A.indices.astype(A.indptr.dtype)),
+				'data': save_array(prefix + 'data.npy', A.data.astype(np.float32)),
+			}
+
+	tmp_path = os.path.join(hgcn_path, MANIFEST + '.tmp')
+	with open(tmp_path, 'w') as out_file:
+		json.dump(manifest, out_file, indent=1)
+	os.replace(tmp_path, os.path.join(hgcn_path, MANIFEST))
+
+
+
+def is_hgcn(hgcn_path):
+	return os.path.exists(os.path.join(hgcn_path, MANIFEST))
+
+
+
+def load_hgcn(hgcn_path):
+	"""Memory-map a dataset directory written by save_hgcn.
+
+	The tensors share the copy-on-write mapped arrays (no copy until written) and
+	the adjacencies are sparse CSR tensors built on the stored indptr/indices/values.
+	"""
+	with open(os.path.join(hgcn_path, MANIFEST)) as in_file:
+		manifest = json.load(in_file)
+
+	def load_array(name):
+		return torch.from_numpy(np.load(os.path.join(hgcn_path, name), mmap_mode='c'))
+
+	label = dict([(k, [load_array(name) for name in manifest['label'][k]]) for k in manifest['label']])
+	ft_dict = dict([(k, load_array(manifest['ft'][k])) for k in manifest['ft']])
+
+	adj_dict = {}
+	for k in manifest['adj']:
+		adj_dict[k] = {}
+		for kk, csr in manifest['adj'][k].items():
+			adj_dict[k][kk] = torch.sparse_csr_tensor(
+				load_array(csr['indptr']), load_array(csr['indices']), load_array(csr['data']), tuple(csr['shape']))
+
+	return label, ft_dict, adj_dict
+
+
+
+def compose_hgcn(*hgcn_paths):
+	"""Load the parts of one dataset saved in separate directories and merge them,
+	e.g. the labels and features built once per feature set and the adjacencies built
+	once per graph"""
+	label, ft_dict, adj_dict = {}, {}, {}
+	for hgcn_path in hgcn_paths:
+		(part_label, part_ft_dict, part_adj_dict) = load_hgcn(hgcn_path)
+		label.update(part_label)
+		ft_dict.update(part_ft_dict)
+		adj_dict.update(part_adj_dict)
+	return label, ft_dict, adj_dict
@@ -4,6 +4,8 @@ import scipy.sparse as sp
 import scipy.io as sio
 import pickle
 import torch
+from build_cache import BuildCache
+from hgcn_store import MANIFEST, save_hgcn, load_hgcn
 from sklearn.feature_extraction.text import HashingVectorizer, TfidfTransformer
 from sklearn.manifold import TSNE
 from sklearn.metrics import normalized_mutual_info_score, adjusted_rand_score
@@ -59,10 +61,12 @@ def visual_embd(seed, train_percent, embd, label):
 def sp_mat_row_normalize(mx):
     """Row-normalize sparse matrix"""
     rowsum = np.array(mx.sum(1))
-    r_inv = np.power(rowsum, -1).flatten()
+    with np.errstate(divide='ignore'):
+        r_inv = np.power(rowsum, -1).flatten()
     r_inv[np.isinf(r_inv)] = 0.
-    r_mat_inv = sp.diags(r_inv)
-    mx = r_mat_inv.dot(mx)
+    r_mat_inv = sp.diags(r_inv.astype(mx.dtype))
+    mx = r_mat_inv.dot(mx).tocsr()
+    mx.eliminate_zeros()
     return mx
 
 
@@ -77,10 +81,11 @@ def row_normalize(mat):
 
 def sp_coo_2_sp_tensor(sp_coo_mat):
     """Convert a scipy sparse matrix to a torch sparse tensor."""
+    sp_coo_mat = sp_coo_mat.tocoo()
     indices = torch.from_numpy(np.vstack((sp_coo_mat.row, sp_coo_mat.col)).astype(np.int64))
-    values = torch.from_numpy(sp_coo_mat.data)
+    values = torch.from_numpy(sp_coo_mat.data.astype(np.float32))
     shape = torch.Size(sp_coo_mat.shape)
-    return torch.sparse.FloatTensor(indices, values, shape)
+    return torch.sparse_coo_tensor(indices, values, shape)
 
 
 
@@ -92,7 +97,7 @@ def accuracy(output, labels):
 
 
 
-def load_imdb3228(train_percent):
+def build_imdb3228(train_percent):
 	# fix the seed of numpy in order to make the experiment reproducible
 	np.random.seed(0)
 
@@ -112,9 +117,8 @@ def load_imdb3228(train_percent):
 	with open(adjacency_matrices_path, 'rb') as in_file:
 		(sp_A_m_a, sp_A_m_c, sp_A_m_d, sp_A_m_t, sp_A_m_u, sp_A_m_g) = pickle.load(in_file)
 
-	# convert the adjacency sparse matrix in a dense array 
-	A_m_g = sp_A_m_g.toarray()
 	# Convert the adjacency sparse matrices in a CSR (Compressed Sparse Row)
+	A_m_g = sp_A_m_g.tocsr()
 	A_m_a = sp_A_m_a.tocsr()
 	A_m_u = sp_A_m_u.tocsr()
 	A_m_d = sp_A_m_d.tocsr()
@@ -123,12 +127,12 @@ def load_imdb3228(train_percent):
 	# Create Labels and Split Indices for Training, Validation, and Test Sets:
 	# In the following row, we compute the sum for each movie over all the genres
 	# with the aim to obtain movies with exactly one genre
-	idx_m = np.where(A_m_g.sum(1)==1)[0]
+	idx_m = np.where(np.asarray(A_m_g.sum(1)).ravel()==1)[0]
 	# we take only 4 genres
 	# we'll obtain at the end for each movie only one genre
 	idx_g = np.array([4,6,7,10])
 	# we filter by the movies that contain the genre previously defined
-	idx_m = idx_m[np.where(A_m_g[idx_m][:,idx_g].sum(1) == 1)[0]]
+	idx_m = idx_m[np.where(np.asarray(A_m_g[idx_m][:,idx_g].sum(1)).ravel() == 1)[0]]
 	
 	# we are interested only to actors, directors and users linked with the filtered movies
 	idx_a = np.where(A_m_a[idx_m].sum(0) > 0)[1]
@@ -143,7 +147,7 @@ def load_imdb3228(train_percent):
 
 	label = {}
 	# m_label contains only values between 0 and 3 that are the indices of the genres related to the movies
-	m_label = torch.LongTensor(A_m_g.argmax(1))
+	m_label = torch.LongTensor(np.asarray(A_m_g.argmax(1)).ravel())
 	# we craete a permutation of the post-filtering movie ids
 	rand_idx = np.random.permutation(m_label.shape[0])
 	# split the remaining part into validation and test
@@ -177,14 +181,15 @@ def load_imdb3228(train_percent):
 
 
 	# Create Adjacency Dictionary with Row-Normalized Sparse Tensors
+	# (the matrices stay sparse: normalized by the diagonal of inverse row sums)
 	adj_dict = {'m':{}, 'a':{}, 'u':{}, 'd':{}}
-	adj_dict['m']['a'] = sp_coo_2_sp_tensor(sp.coo_matrix(row_normalize(A_m_a)))
-	adj_dict['m']['u'] = sp_coo_2_sp_tensor(sp.coo_matrix(row_normalize(A_m_u)))
-	adj_dict['m']['d'] = sp_coo_2_sp_tensor(sp.coo_matrix(row_normalize(A_m_d)))
+	adj_dict['m']['a'] = sp_coo_2_sp_tensor(sp_mat_row_normalize(A_m_a))
+	adj_dict['m']['u'] = sp_coo_2_sp_tensor(sp_mat_row_normalize(A_m_u))
+	adj_dict['m']['d'] = sp_coo_2_sp_tensor(sp_mat_row_normalize(A_m_d))
 	
-	adj_dict['a']['m'] = sp_coo_2_sp_tensor(sp.coo_matrix(row_normalize(A_m_a.transpose())))
-	adj_dict['u']['m'] = sp_coo_2_sp_tensor(sp.coo_matrix(row_normalize(A_m_u.transpose())))
-	adj_dict['d']['m'] = sp_coo_2_sp_tensor(sp.coo_matrix(row_normalize(A_m_d.transpose())))
+	adj_dict['a']['m'] = sp_coo_2_sp_tensor(sp_mat_row_normalize(A_m_a.transpose().tocsr()))
+	adj_dict['u']['m'] = sp_coo_2_sp_tensor(sp_mat_row_normalize(A_m_u.transpose().tocsr()))
+	adj_dict['d']['m'] = sp_coo_2_sp_tensor(sp_mat_row_normalize(A_m_d.transpose().tocsr()))
 
 	# return label, ft_dict, adj_dict
 
@@ -192,34 +197,10 @@ def load_imdb3228(train_percent):
 
 	# hgcn write
 	# Save Processed Data for Heterogeneous Graph Convolutional Networks (HGCN):
-	#hgcn_path = './data/imdb3228/imdb3228_hgcn_'+str(train_percent)+'.pkl'
-	hgcn_path = os.path.join(current_dir, 'imbd10197_dataset', 'imbd10197_hgcn_'+str(train_percent)+'.pkl')
+	# raw CSR/feature/split arrays plus a manifest, memory-mapped back on load
+	hgcn_path = os.path.join(current_dir, 'imbd10197_dataset', 'imbd10197_hgcn_'+str(train_percent))
 	print('hgcn dump: ', hgcn_path)
-	with open(hgcn_path, 'wb') as out_file:
-		adj_dict['m']['a'] = adj_dict['m']['a'].to_dense()
-		adj_dict['m']['u'] = adj_dict['m']['u'].to_dense()
-		adj_dict['m']['d'] = adj_dict['m']['d'].to_dense()
-		
-		adj_dict['a']['m'] = adj_dict['a']['m'].to_dense()
-		adj_dict['u']['m'] = adj_dict['u']['m'].to_dense()
-		adj_dict['d']['m'] = adj_dict['d']['m'].to_dense()
-
-		pickle.dump((label, ft_dict, adj_dict), out_file)
-
-
-	# hgcn load
-	# Load Saved HGCN Data and Convert Dense Matrices Back to Sparse:
-	#hgcn_path = './data/imdb3228/imdb3228_hgcn_'+str(train_percent)+'.pkl'
-	print('hgcn load: ', hgcn_path, '\n')
-	with open(hgcn_path, 'rb') as in_file:
-		(label, ft_dict, adj_dict) = pickle.load(in_file)
-		adj_dict['m']['a'] = adj_dict['m']['a'].to_sparse()
-		adj_dict['m']['u'] = adj_dict['m']['u'].to_sparse()
-		adj_dict['m']['d'] = adj_dict['m']['d'].to_sparse()
-		
-		adj_dict['a']['m'] = adj_dict['a']['m'].to_sparse()
-		adj_dict['u']['m'] = adj_dict['u']['m'].to_sparse()
-		adj_dict['d']['m'] = adj_dict['d']['m'].to_sparse()
+	save_hgcn(hgcn_path, label, ft_dict, adj_dict)
 
 	# Return processed data
 	return label, ft_dict, adj_dict
@@ -433,6 +414,23 @@ def load_imdb10197():
 
 
 
+def load_imdb3228(train_percent):
+	# build the dataset directory only if the raw pickles, the train percentage or
+	# build_imdb3228 itself changed since the last build, then memory-map it
+	current_dir = os.path.dirname(os.path.abspath(__file__))
+	dataset_dir = os.path.join(current_dir, 'imbd10197_dataset')
+	hgcn_path = os.path.join(dataset_dir, 'imbd10197_hgcn_'+str(train_percent))
+
+	cache = BuildCache(os.path.join(dataset_dir, 'build_cache.json'))
+	cache.run(build_imdb3228, train_percent,
+		inputs=[os.path.join(dataset_dir, 'imdb10197_movie_feature.pkl'), os.path.join(dataset_dir, 'imdb10197_sp_adj_mats.pkl')],
+		outputs=[os.path.join(hgcn_path, MANIFEST)])
+
+	print('hgcn load: ', hgcn_path, '\n')
+	return load_hgcn(hgcn_path)
+
+
+
 if __name__ == '__main__':
 	load_imdb3228(0.2)	
 	'''load_imdb3228(0.4)	
@@ -2,103 +2,24 @@ import numpy as np
 import torch
 import torch.nn.functional as F
 import torch.optim as optim
-from sklearn.metrics import f1_score
-
-import warnings
-import sklearn.exceptions
-warnings.filterwarnings("ignore", category=sklearn.exceptions.UndefinedMetricWarning)
 
 import time
 
 from imdb10197_util import *
-from model import HGCN
-
-def train(epoch):
-
-    model.train()
-    optimizer.zero_grad()
-    logits, _ = model(ft_dict, adj_dict)
-
-    m_logits = F.log_softmax(logits['m'], dim=1)
-    idx_train_m = label['m'][1]
-    x_train_m = m_logits[idx_train_m]
-    y_train_m = label['m'][0][idx_train_m]
-    loss_train = F.nll_loss(x_train_m, y_train_m)
-    f1_micro_train_m = f1_score(y_train_m.data.cpu(), x_train_m.data.cpu().argmax(1), average='micro')
-    f1_macro_train_m = f1_score(y_train_m.data.cpu(), x_train_m.data.cpu().argmax(1), average='macro')
-
-    # p_logits = F.log_softmax(logits['p'], dim=1)
-    # idx_train_p = label['p'][1]
-    # x_train_p = p_logits[idx_train_p]
-    # y_train_p = label['p'][0][idx_train_p]
-    # loss_train = F.nll_loss(x_train_p, y_train_p)
-    # f1_micro_train_p = f1_score(y_train_p.data.cpu(), x_train_p.data.cpu().argmax(1), average='micro')
-    # f1_macro_train_p = f1_score(y_train_p.data.cpu(), x_train_p.data.cpu().argmax(1), average='macro')
-
-    # a_logits = F.log_softmax(logits['a'], dim=1)
-    # idx_train_a = label['a'][1]
-    # x_train_a = a_logits[idx_train_a]
-    # y_train_a = label['a'][0][idx_train_a]
-    # loss_train = F.nll_loss(x_train_a, y_train_a)
-    # f1_micro_train_a = f1_score(y_train_a.data.cpu(), x_train_a.data.cpu().argmax(1), average='micro')
-    # f1_macro_train_a = f1_score(y_train_a.data.cpu(), x_train_a.data.cpu().argmax(1), average='macro')
-
-    loss_train.backward()
-    optimizer.step()
-
-    '''///////////////// Validation ///////////////////'''
-    model.eval()
-    logits, _ = model(ft_dict, adj_dict)
-
-    m_logits = F.log_softmax(logits['m'], dim=1)
-    idx_val_m = label['m'][2]
-    x_val_m = m_logits[idx_val_m]
-    y_val_m = label['m'][0][idx_val_m]
-    f1_micro_val_m = f1_score(y_val_m.data.cpu(), x_val_m.data.cpu().argmax(1), average='micro')
-    f1_macro_val_m = f1_score(y_val_m.data.cpu(), x_val_m.data.cpu().argmax(1), average='macro')
-
-    # p_logits = F.log_softmax(logits['p'], dim=1)
-    # idx_val_p = label['p'][2]
-    # x_val_p = p_logits[idx_val_p]
-    # y_val_p = label['p'][0][idx_val_p]
-    # f1_micro_val_p = f1_score(y_val_p.data.cpu(), x_val_p.data.cpu().argmax(1), average='micro')
-    # f1_macro_val_p = f1_score(y_val_p.data.cpu(), x_val_p.data.cpu().argmax(1), average='macro')
-
-    # a_logits = F.log_softmax(logits['a'], dim=1)
-    # idx_val_a = label['a'][2]
-    # x_val_a = a_logits[idx_val_a]
-    # y_val_a = label['a'][0][idx_val_a]
-    # f1_micro_val_a = f1_score(y_val_a.data.cpu(), x_val_a.data.cpu().argmax(1), average='micro')
-    # f1_macro_val_a = f1_score(y_val_a.data.cpu(), x_val_a.data.cpu().argmax(1), average='macro')
-
-    if epoch % 1 == 0:
-        print(
-            'epoch: {:3d}'.format(epoch),
-            'train loss: {:.4f}'.format(loss_train.item()),
-            'train micro f1 m: {:.4f}'.format(f1_micro_train_m.item()),
-            'train macro f1 m: {:.4f}'.format(f1_macro_train_m.item()),
-            'val micro f1 m: {:.4f}'.format(f1_micro_val_m.item()),
-            'val macro f1 m: {:.4f}'.format(f1_macro_val_m.item()),
-            # 'train micro f1 p: {:.4f}'.format(f1_micro_train_p.item()),
-            # 'train macro f1 p: {:.4f}'.format(f1_macro_train_p.item()),
-            # 'val micro f1 p: {:.4f}'.format(f1_micro_val_p.item()),
-            # 'val macro f1 p: {:.4f}'.format(f1_macro_val_p.item()),
-            # 'train micro f1 a: {:.4f}'.format(f1_micro_train_a.item()),
-            # 'train macro f1 a: {:.4f}'.format(f1_macro_train_a.item()),
-            # 'val micro f1 a: {:.4f}'.format(f1_micro_val_a.item()),
-            # 'val macro f1 a: {:.4f}'.format(f1_macro_val_a.item()),
-        )
+from model import HGCN, build_net_schema
+from ensemble import HGCNEnsemble
+from propagation import sign_features
+from sampler import NeighborSampler, receptive_field, slice_features, blocks_to
+from trainer import Trainer
+from checkpoint import Checkpointer
+from metrics import ConfusionMatrix
+from telemetry import AttentionCollector, MemorySink
 
 def test():
-    model.eval()
-    logits, embd = model(ft_dict, adj_dict)
-
-    m_logits = F.log_softmax(logits['m'], dim=1)
     idx_test_m = label['m'][3]
-    x_test_m = m_logits[idx_test_m]
+    x_test_m = trainer.predict(idx_test_m)
     y_test_m = label['m'][0][idx_test_m]
-    f1_micro_test_m = f1_score(y_test_m.data.cpu(), x_test_m.data.cpu().argmax(1), average='micro')
-    f1_macro_test_m = f1_score(y_test_m.data.cpu(), x_test_m.data.cpu().argmax(1), average='macro')
+    f1_micro_test_m, f1_macro_test_m = ConfusionMatrix.of(y_test_m, x_test_m).f1()
 
     # p_logits = F.log_softmax(logits['p'], dim=1)
     # idx_test_p = label['p'][3]
@@ -128,6 +49,25 @@ def test():
     # return (f1_micro_test_p, f1_macro_test_p)
     # return (f1_micro_test_a, f1_macro_test_a)
 
+def replica_f1(y, logits):
+    """Micro and macro f1 of every replica of [R, N, C] ensemble logits"""
+    f1_micro, f1_macro = ConfusionMatrix.of(y, logits).f1()
+    return f1_micro.cpu().numpy(), f1_macro.cpu().numpy()
+
+def test_ensemble():
+    idx_test_m = label['m'][3]
+    f1_micro_test_m, f1_macro_test_m = replica_f1(label['m'][0][idx_test_m], trainer.predict(idx_test_m))
+
+    for seed, f1_micro, f1_macro in zip(model.seeds, f1_micro_test_m, f1_macro_test_m):
+        print('seed: ', seed, 'test micro f1 m: {:.4f}'.format(f1_micro), 'test macro f1 m: {:.4f}'.format(f1_macro))
+    print(
+        '\n'+
+        'test micro f1 m: {:.4f} +- {:.4f}'.format(f1_micro_test_m.mean(), f1_micro_test_m.std()),
+        'test macro f1 m: {:.4f} +- {:.4f}'.format(f1_macro_test_m.mean(), f1_macro_test_m.std()),
+    )
+
+    return (f1_micro_test_m, f1_macro_test_m)
+
 if __name__ == '__main__':
 
     cuda = True # Enables CUDA training.
@@ -135,6 +75,22 @@ if __name__ == '__main__':
     weight_decay = 5e-4 # Weight decay (L2 loss on parameters).
     type_att_size = 64 # type attention parameter dimension
     type_fusion = 'att' # mean
+    fuse_proj = True # one projection matmul per source node type in each layer
+    packed = True # keep the hidden states of all node types in one tensor between layers
+    log_attention = False # collect the mean type attention of every layer and node type
+    att_log_interval = 50 # forward passes between two attention flushes
+    grad_checkpoint = False # recompute the activations of every layer in backward instead of storing them
+    precompute_prop = True # compute A_k x_k of the fixed input features once and reuse it in the first layer
+    prune = True # compute only the rows of every layer the training loss depends on
+    batch_size = 0 # > 0 trains on neighbor-sampled mini-batches of labelled movies
+    fanout = 10 # neighbors sampled per node and relation in every layer
+    sign_hops = 0 # > 0 appends the features propagated up to sign_hops relation hops (SIGN-style) to the inputs
+    ensemble = False # train the run_num seeds at once as the replicas of one HGCNEnsemble (switches off fuse_proj, packed and log_attention)
+    val_interval = 1 # epochs between two evaluations of the validation movies
+    log_interval = 1 # epochs between two prints of the training loss and f1
+    patience = 0 # > 0 stops after patience evaluations without a better val f1 and restores the best weights
+    checkpoint_interval = 0 # > 0 saves the model, optimizer and RNG states of the run every checkpoint_interval epochs
+    resume = False # continue every run from its last checkpoint, when it has one
 
     # # scalability
     # author_num = [14475,10000,7000,5500,4000,2500,1500,800]
@@ -162,7 +118,11 @@ if __name__ == '__main__':
 
     run_num = 1
     train_percent = 0.2
-    for run in range(run_num):
+    if ensemble and (fuse_proj or packed or log_attention):
+        # the replicas already share every adjacency product, and their attention is not recorded
+        print('ensemble: fuse_proj, packed and log_attention are switched off')
+        fuse_proj = packed = log_attention = False
+    for run in range(1 if ensemble else run_num):
         t_start = time.time()
         seed = run
 
@@ -192,6 +152,9 @@ if __name__ == '__main__':
         # label, ft_dict, adj_dict = load_imdb3228(train_percent)
         # output_layer_shape = dict.fromkeys(ft_dict.keys(), 4)
 
+        if sign_hops > 0:
+            ft_dict = sign_features(ft_dict, adj_dict, sign_hops)
+
         layer_shape = []
         input_layer_shape = dict([(k, ft_dict[k].shape[1]) for k in ft_dict.keys()])
         layer_shape.append(input_layer_shape)
@@ -200,16 +163,35 @@ if __name__ == '__main__':
         layer_shape.append(output_layer_shape)
 
         # Model and optimizer
-        net_schema = dict([(k, list(adj_dict[k].keys())) for k in adj_dict.keys()])
-        model = HGCN(
-            net_schema=net_schema,
-            layer_shape=layer_shape,
-            label_keys=list(label.keys()),
-            type_fusion=type_fusion,
-            type_att_size=type_att_size,
-        )
+        net_schema = build_net_schema(adj_dict)
+        if ensemble:
+            model = HGCNEnsemble(
+                seeds=list(range(seed, seed + run_num)),
+                net_schema=net_schema,
+                layer_shape=layer_shape,
+                label_keys=list(label.keys()),
+                type_fusion=type_fusion,
+                type_att_size=type_att_size,
+                fuse_proj=fuse_proj,
+                grad_checkpoint=grad_checkpoint,
+                packed=packed,
+            )
+        else:
+            model = HGCN(
+                net_schema=net_schema,
+                layer_shape=layer_shape,
+                label_keys=list(label.keys()),
+                type_fusion=type_fusion,
+                type_att_size=type_att_size,
+                fuse_proj=fuse_proj,
+                grad_checkpoint=grad_checkpoint,
+                packed=packed,
+            )
         optimizer = optim.Adam(model.parameters(), lr=lr, weight_decay=weight_decay)
 
+        att_collector = AttentionCollector(MemorySink(), interval=att_log_interval) if log_attention else None
+        model.register_attention_collector(att_collector)
+
         if cuda and torch.cuda.is_available():
             model.cuda()
 
@@ -222,10 +204,35 @@ if __name__ == '__main__':
                 for i in range(len(label[k])):
                     label[k][i] = label[k][i].cuda()
 
-        for epoch in range(epochs):
-            train(epoch)
-
-        (micro_f1, macro_f1) = test()
+        if precompute_prop:
+            model.bind(ft_dict, adj_dict)
+
+        sampler = NeighborSampler(adj_dict, [fanout] * len(hid_layer_dim), seed) if batch_size > 0 else None
+
+        train_field = None
+        if prune:
+            input_nodes, blocks, first_nodes = receptive_field(adj_dict, 'm', label['m'][1], len(hid_layer_dim))
+            train_field = (slice_features(ft_dict, input_nodes), blocks_to(blocks, label['m'][0].device))
+            if precompute_prop:
+                # the first layer of the pruned forward reads its rows of the precomputed A_k x_k
+                train_field += (model.bound_rows(first_nodes),)
+
+        trainer = Trainer(model, optimizer, ft_dict, adj_dict, 'm', label['m'][0], label['m'][1], label['m'][2],
+                          train_field=train_field, sampler=sampler, batch_size=batch_size,
+                          val_interval=val_interval, patience=patience, log_interval=log_interval)
+        if checkpoint_interval > 0 or resume:
+            checkpoint_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'checkpoints', 'imdb10197_run_' + str(run) + '.pt')
+            trainer.checkpointer = Checkpointer(checkpoint_path, checkpoint_interval)
+            if resume:
+                trainer.resume()
+        trainer.fit(epochs)
+
+        (micro_f1, macro_f1) = test_ensemble() if ensemble else test()
+
+        if att_collector is not None:
+            att_collector.flush()
+            for record in [r for r in att_collector.sink.records if r['step'] == att_collector.step_num]:
+                print('layer: ', record['layer'], 'curr key: ', record['type'], 'nb att: ', record['attention'])
 
         t_end = time.time()
         print('Total time: ', t_end - t_start)
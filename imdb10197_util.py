@@ -3,6 +3,7 @@ import scipy.sparse as sp
 import scipy.io as sio
 import pickle
 import torch
+from hgcn_store import load_hgcn
 import os
 from sklearn.feature_extraction.text import HashingVectorizer, TfidfTransformer
 
@@ -28,17 +29,9 @@ def sp_coo_2_sp_tensor(sp_coo_mat):
 def load_imdb3228(train_percent):
 	current_dir = os.path.dirname(os.path.abspath(__file__))
 	#hgcn_path = os.path.join(current_dir, 'data', 'imdb3228', 'imdb3228_hgcn_' + str(train_percent)+'.pkl')
-	hgcn_path = os.path.join(current_dir, 'imbd10197_dataset', 'imbd10197_hgcn_'+str(train_percent)+'.pkl')
+	hgcn_path = os.path.join(current_dir, 'imbd10197_dataset', 'imbd10197_hgcn_'+str(train_percent))
 	print('hgcn load: ', hgcn_path, '\n')
-	with open(hgcn_path, 'rb') as in_file:
-		(label, ft_dict, adj_dict) = pickle.load(in_file)
-		adj_dict['m']['a'] = adj_dict['m']['a'].to_sparse()
-		adj_dict['m']['u'] = adj_dict['m']['u'].to_sparse()
-		adj_dict['m']['d'] = adj_dict['m']['d'].to_sparse()
-		
-		adj_dict['a']['m'] = adj_dict['a']['m'].to_sparse()
-		adj_dict['u']['m'] = adj_dict['u']['m'].to_sparse()
-		adj_dict['d']['m'] = adj_dict['d']['m'].to_sparse()
+	(label, ft_dict, adj_dict) = load_hgcn(hgcn_path)
 
 	return label, ft_dict, adj_dict
 
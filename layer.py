@@ -2,31 +2,144 @@ import torch
 import torch.nn as nn
 import torch.nn.functional as F
 
+from packed import PackedDict
+
+
+def spmm(adj, x):
+	"""A x for x of shape [N, d], or [R, N, d]: the R matrices are laid side by side as one
+	N x (R*d) matrix, so the sparse product runs once"""
+	if x.dim() == 2:
+		return torch.spmm(adj, x)
+	R, N, d = x.shape
+	wide = torch.spmm(adj, x.transpose(0, 1).reshape(N, R * d))
+	return wide.view(-1, R, d).transpose(0, 1)
+
+
+
+def output_rows(self_ft, adj_dict):
+	"""The rows of self_ft of the output nodes of a relation dict adj_dict.
+
+	In a sampled or pruned block the output nodes are the first input nodes of their
+	type. Every relation of the block has one row per output node, also the ones
+	without edges that the layers skip, so any of them gives the count.
+	"""
+	if not adj_dict:
+		return self_ft
+	return self_ft[..., :next(iter(adj_dict.values())).shape[0], :]
+
+
+
+def neighbor_ft(adj, x, W_rel, proj=None, prop=None):
+	"""The neighbor term A x W_rel of one relation, for W_rel of shape [d_in, d] or [R, d_in, d].
+
+	prop is the precomputed A x, so (A x) W_rel replaces A (x W_rel); proj is the
+	projection x W_rel when it is already computed. Otherwise a shared [N, d_in]
+	input no wider than all its projections is propagated first, then projected.
+	"""
+	if prop is not None:
+		return torch.matmul(prop, W_rel)
+	if proj is None:
+		if x.dim() == 2 and x.shape[1] <= W_rel[..., 0, :].numel():
+			return torch.matmul(torch.spmm(adj, x), W_rel)
+		proj = torch.matmul(x, W_rel)
+	return spmm(adj, proj)
+
+
+
+def fuse_types(nb_ft_list, type_fusion, att_weights=None, training=False):
+	"""Fuse the self features and the neighbor terms of every type, all [..., N, d] tensors.
+
+	att_weights is the (w_query, w_keys, w_att) triple of the type attention, each
+	[..., rows, cols]. Returns the fused features and the attention ([..., N, T],
+	None unless the types are fused by attention).
+	"""
+	if len(nb_ft_list) == 1:
+		return nb_ft_list[0], None
+
+	if type_fusion == 'mean':
+		return torch.stack(nb_ft_list, -2).mean(-2), None
+
+	# w_att scores [keys, query] rows, so split it and score every type as a broadcast sum
+	# instead of materializing the repeated query and the concatenated keys
+	w_query, w_keys, w_att = att_weights
+	self_ft = nb_ft_list[0]
+	att_size = w_query.shape[-1]
+	w_att_keys, w_att_query = w_att[..., :att_size, :], w_att[..., att_size:, :]
+	if training:
+		att_query = torch.matmul(self_ft, w_query)
+		e = torch.cat([
+			torch.matmul(F.dropout(torch.matmul(nb_ft, w_keys), 0.5), w_att_keys) +
+			torch.matmul(F.dropout(att_query, 0.5), w_att_query)
+			for nb_ft in nb_ft_list], -1)
+	else:
+		e = torch.cat([torch.matmul(nb_ft, torch.matmul(w_keys, w_att_keys)) for nb_ft in nb_ft_list], -1)
+		e = e + torch.matmul(self_ft, torch.matmul(w_query, w_att_query))
+	attention = F.softmax(F.elu(e), dim=-1)
+	return torch.matmul(attention.unsqueeze(-2), torch.stack(nb_ft_list, -2)).squeeze(-2), attention
+
 
 
 class HeteGCNLayer(nn.Module):
 
-	def __init__(self, net_schema, in_layer_shape, out_layer_shape, type_fusion, type_att_size):
+	def __init__(self, net_schema, in_layer_shape, out_layer_shape, type_fusion, type_att_size, fuse_proj=False, packed=False):
 		super(HeteGCNLayer, self).__init__()
 		
 		self.net_schema = net_schema
 		self.in_layer_shape = in_layer_shape
 		self.out_layer_shape = out_layer_shape
+		self.fuse_proj = fuse_proj
+		# the output can only be packed when every node type has the same hidden size
+		self.packed = packed and len(set(out_layer_shape[k] for k in net_schema)) == 1
 
 		self.hete_agg = nn.ModuleDict()
 		for k in net_schema:
 			self.hete_agg[k] = HeteAggregateLayer(k, net_schema[k], in_layer_shape, out_layer_shape[k], type_fusion, type_att_size)
 
 
-	def forward(self, x_dict, adj_dict):
+	def forward(self, x_dict, adj_dict, prop_dict=None):
 		
+		proj_dict = self.fused_projection(x_dict) if self.fuse_proj and prop_dict is None else {}
+
 		ret_x_dict = {}
 		for k in self.hete_agg.keys():
-			ret_x_dict[k] = self.hete_agg[k](x_dict, adj_dict[k])
+			prop = prop_dict[k] if prop_dict is not None else None
+			ret_x_dict[k] = self.hete_agg[k](x_dict, adj_dict[k], proj_dict.get(k), prop, add_bias=not self.packed)
+
+		if self.packed:
+			ret_x_dict = self.pack_bias(ret_x_dict)
 
 		return ret_x_dict
 
 
+	def pack_bias(self, agg_dict):
+		"""Pack the aggregated features of all node types and add each type's bias to its rows in place"""
+		x_packed = PackedDict.pack(agg_dict)
+		for k in agg_dict:
+			x_packed[k].add_(self.hete_agg[k].bias)
+		return x_packed
+
+
+	def fused_projection(self, x_dict):
+		"""Project each source type once, with all the weights reading it concatenated in a single matmul"""
+		groups = {}
+		for curr_k, agg in self.hete_agg.items():
+			groups.setdefault(curr_k, []).append((curr_k, None, agg.w_self))
+			for k in agg.nb_list:
+				groups.setdefault(k, []).append((curr_k, k, agg.W_rel[k]))
+
+		proj_dict = dict([(k, [None, {}]) for k in self.hete_agg.keys()])
+		for src_k, slots in groups.items():
+			W = torch.cat([w for _, _, w in slots], 1) if len(slots) > 1 else slots[0][2]
+			fts = torch.mm(x_dict[src_k], W).split([w.shape[1] for _, _, w in slots], 1)
+			for (curr_k, nb_k, _), ft in zip(slots, fts):
+				if nb_k is None:
+					proj_dict[curr_k][0] = ft
+				else:
+					proj_dict[curr_k][1][nb_k] = ft
+
+		return proj_dict
+
+
 
 class HeteAggregateLayer(nn.Module):
 	
@@ -36,6 +149,8 @@ class HeteAggregateLayer(nn.Module):
 		self.nb_list = nb_list
 		self.curr_k = curr_k
 		self.type_fusion = type_fusion
+		self.att_collector = None
+		self.layer_idx = None
 		
 		self.W_rel = nn.ParameterDict()
 		for k in nb_list:
@@ -48,7 +163,8 @@ class HeteAggregateLayer(nn.Module):
 		self.bias = nn.Parameter(torch.FloatTensor(1, out_shape))
 		nn.init.xavier_uniform_(self.bias.data, gain=1.414)
 
-		if type_fusion == 'att':
+		# without neighbor types the layer is a per-node projection: no type attention
+		if type_fusion == 'att' and nb_list:
 			self.w_query = nn.Parameter(torch.FloatTensor(out_shape, type_att_size))
 			nn.init.xavier_uniform_(self.w_query.data, gain=1.414)
 			self.w_keys = nn.Parameter(torch.FloatTensor(out_shape, type_att_size))
@@ -57,31 +173,40 @@ class HeteAggregateLayer(nn.Module):
 			nn.init.xavier_uniform_(self.w_att.data, gain=1.414)
 
 
-	def forward(self, x_dict, adj_dict):
-
+	def project(self, x_dict):
 		self_ft = torch.mm(x_dict[self.curr_k], self.w_self)
-		
+		nb_proj = {}
+		for k in self.nb_list:
+			nb_proj[k] = torch.mm(x_dict[k], self.W_rel[k])
+		return self_ft, nb_proj
+
+
+	def forward(self, x_dict, adj_dict, proj=None, prop=None, add_bias=True):
+
+		# prop holds the precomputed A_k x_k of every relation, so (A_k x_k) W_rel[k] replaces A_k (x_k W_rel[k])
+		# proj is the (self_ft, {nb_k: x_k W_rel[k]}) pair already computed by a fused HeteGCNLayer
+		if prop is not None:
+			self_ft = torch.mm(x_dict[self.curr_k], self.w_self)
+		else:
+			if proj is None:
+				proj = self.project(x_dict)
+			self_ft, nb_proj = proj
+
+		self_ft = output_rows(self_ft, adj_dict)
+
 		nb_ft_list = [self_ft]
-		nb_name = [self.curr_k]
 		for k in self.nb_list:
-			nb_ft = torch.mm(x_dict[k], self.W_rel[k])
-			nb_ft = torch.spmm(adj_dict[k], nb_ft)
-			nb_ft_list.append(nb_ft)
-			nb_name.append(k)
-		
-		if self.type_fusion == 'mean':
-			agg_nb_ft = torch.cat([nb_ft.unsqueeze(1) for nb_ft in nb_ft_list], 1).mean(1)
-
-		elif self.type_fusion == 'att':
-			att_query = torch.mm(self_ft, self.w_query).repeat(len(nb_ft_list), 1)
-			att_keys = torch.mm(torch.cat(nb_ft_list, 0), self.w_keys)
-			att_input = torch.cat([att_keys, att_query], 1)
-			att_input = F.dropout(att_input, 0.5, training=self.training)
-			e = F.elu(torch.matmul(att_input, self.w_att))
-			attention = F.softmax(e.view(len(nb_ft_list), -1).transpose(0,1), dim=1)
-			agg_nb_ft = torch.cat([nb_ft.unsqueeze(1) for nb_ft in nb_ft_list], 1).mul(attention.unsqueeze(-1)).sum(1)
-			print('curr key: ', self.curr_k, 'nb att: ', nb_name, attention.mean(0).tolist())
-
-		output = agg_nb_ft + self.bias
+			if prop is not None:
+				nb_ft_list.append(neighbor_ft(adj_dict[k], x_dict[k], self.W_rel[k], prop=prop[k]))
+			else:
+				nb_ft_list.append(neighbor_ft(adj_dict[k], x_dict[k], self.W_rel[k], proj=nb_proj[k]))
+
+		att_weights = (self.w_query, self.w_keys, self.w_att) if self.type_fusion == 'att' and self.nb_list else None
+		agg_nb_ft, attention = fuse_types(nb_ft_list, self.type_fusion, att_weights, self.training)
+		# only training passes are recorded: evaluation attention has no dropout and would skew the window
+		if attention is not None and self.att_collector is not None and self.training:
+			self.att_collector.record(self.layer_idx, self.curr_k, ['self'] + list(self.nb_list), attention)
+
+		output = agg_nb_ft + self.bias if add_bias else agg_nb_ft
 
 		return output
\ No newline at end of file
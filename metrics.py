@@ -0,0 +1,85 @@
+import torch
+
+
+
+class ConfusionMatrix:
+	"""Counts of (true, predicted) class pairs, kept on the device of the predictions.
+
+	update() takes log probabilities or logits, [N, C] for one model or [R, N, C] for
+	the R replicas of an ensemble, and adds them with a single bincount; batches of an
+	epoch can be added one after the other. The scores are derived from the matrix
+	as tensors on the same device, so nothing is copied to the host until they are
+	logged. As in sklearn, the macro average runs over the classes that occur in the
+	labels or in the predictions.
+	"""
+
+	def __init__(self, num_classes, replicas=0, device=None):
+		self.num_classes = num_classes
+		self.replicas = replicas
+		self.counts = torch.zeros(max(replicas, 1), num_classes, num_classes, dtype=torch.long, device=device)
+
+
+	@classmethod
+	def of(cls, y, x):
+		"""The confusion matrix of the predictions x for the labels y"""
+		return cls(x.shape[-1], x.shape[0] if x.dim() == 3 else 0, x.device).update(y, x)
+
+
+	def update(self, y, x):
+		C = self.num_classes
+		preds = x.detach().argmax(-1).view(-1, y.shape[0])
+		replica = torch.arange(preds.shape[0], device=preds.device).unsqueeze(1)
+		cells = (replica * C + y.unsqueeze(0)) * C + preds
+		self.counts += torch.bincount(cells.flatten(), minlength=self.counts.numel()).view_as(self.counts)
+		return self
+
+
+	def squeeze(self, scores):
+		return scores if self.replicas else scores[0]
+
+
+	def per_class(self):
+		"""Precision, recall, f1 and support of every class: [C] tensors, [R, C] for an ensemble"""
+		tp = self.counts.diagonal(dim1=1, dim2=2).double()
+		support = self.counts.sum(2).double()
+		predicted = self.counts.sum(1).double()
+		precision = tp / predicted.clamp(min=1)
+		recall = tp / support.clamp(min=1)
+		f1 = 2 * tp / (support + predicted).clamp(min=1)
+		return self.squeeze(precision), self.squeeze(recall), self.squeeze(f1), self.squeeze(support)
+
+
+	def f1(self):
+		"""Micro and macro f1: scalar tensors, [R] for an ensemble"""
+		tp = self.counts.diagonal(dim1=1, dim2=2).double()
+		support = self.counts.sum(2).double()
+		predicted = self.counts.sum(1).double()
+		f1_micro = tp.sum(1) / support.sum(1).clamp(min=1)
+		present = (support + predicted) > 0
+		f1 = 2 * tp / (support + predicted).clamp(min=1)
+		f1_macro = (f1 * present).sum(1) / present.sum(1).clamp(min=1)
+		return self.squeeze(f1_micro), self.squeeze(f1_macro)
+
+
+	def report(self, digits=2):
+		"""Text report of the per-class scores, laid out like sklearn's classification_report"""
+		if self.replicas:
+			raise ValueError('report() of an ensemble: report the confusion matrix of one replica')
+		precision, recall, f1, support = [score.tolist() for score in self.per_class()]
+		f1_micro, f1_macro = [score.item() for score in self.f1()]
+		present = ((self.counts[0].sum(0) + self.counts[0].sum(1)) > 0).nonzero().flatten().tolist()
+		total = sum(support)
+
+		width = max(len('weighted avg'), digits)
+		row = '{:>{width}s} ' + ' {:>9.{digits}f}' * 3 + ' {:>9}\n'
+		header = '{:>{width}s} ' + ' {:>9}' * 4 + '\n\n'
+		lines = [header.format('', 'precision', 'recall', 'f1-score', 'support', width=width)]
+		for c in present:
+			lines.append(row.format(str(c), precision[c], recall[c], f1[c], int(support[c]), width=width, digits=digits))
+		lines.append('\n')
+		lines.append(('{:>{width}s} ' + ' {:>9}' * 2 + ' {:>9.{digits}f} {:>9}\n').format('accuracy', '', '', f1_micro, int(total), width=width, digits=digits))
+		macro = [sum(score[c] for c in present) / max(len(present), 1) for score in (precision, recall)]
+		lines.append(row.format('macro avg', macro[0], macro[1], f1_macro, int(total), width=width, digits=digits))
+		weighted = [sum(score[c] * support[c] for c in present) / max(total, 1) for score in (precision, recall, f1)]
+		lines.append(row.format('weighted avg', *weighted, int(total), width=width, digits=digits))
+		return ''.join(lines)
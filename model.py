@@ -1,28 +1,37 @@
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
+from torch.utils.checkpoint import checkpoint
 
 from layer import HeteGCNLayer
+from packed import PackedDict
+from propagation import BoundPropagation
 
 
 
-class HGCN(nn.Module):
+def build_net_schema(adj_dict):
+	"""Neighbor types of every node type, leaving out relations without any edge:
+	their neighbor term is zero, so the layers skip them entirely"""
+	net_schema = {}
+	for k in adj_dict:
+		net_schema[k] = [kk for kk in adj_dict[k] if adj_dict[k][kk]._nnz() > 0]
+	return net_schema
+
+
+
+class HGCN(BoundPropagation, nn.Module):
 	
-	def __init__(self, net_schema, layer_shape, label_keys, type_fusion='att', type_att_size=64):
+	def __init__(self, net_schema, layer_shape, label_keys, type_fusion='att', type_att_size=64, fuse_proj=False, grad_checkpoint=False, packed=False):
 		super(HGCN, self).__init__()
 		
-		self.hgc1 = HeteGCNLayer(net_schema, layer_shape[0], layer_shape[1], type_fusion, type_att_size)
-		self.hgc2 = HeteGCNLayer(net_schema, layer_shape[1], layer_shape[2], type_fusion, type_att_size)
-		self.hgc3 = HeteGCNLayer(net_schema, layer_shape[2], layer_shape[3], type_fusion, type_att_size)
-		self.hgc4 = HeteGCNLayer(net_schema, layer_shape[3], layer_shape[4], type_fusion, type_att_size)
-		
-
-		# self.hgc5 = HeteGCNLayer(net_schema, layer_shape[4], layer_shape[5], type_fusion, type_att_size)
-		# self.hgc6 = HeteGCNLayer(net_schema, layer_shape[5], layer_shape[6], type_fusion, type_att_size)
-		# self.hgc7 = HeteGCNLayer(net_schema, layer_shape[6], layer_shape[7], type_fusion, type_att_size)
-		# self.hgc8 = HeteGCNLayer(net_schema, layer_shape[7], layer_shape[8], type_fusion, type_att_size)
-		# self.hgc9 = HeteGCNLayer(net_schema, layer_shape[8], layer_shape[9], type_fusion, type_att_size)
+		# one HeteGCNLayer between every two consecutive layer shapes, the last shape being the classifier output
+		self.hgc = nn.ModuleList()
+		for i in range(len(layer_shape) - 2):
+			self.hgc.append(HeteGCNLayer(net_schema, layer_shape[i], layer_shape[i+1], type_fusion, type_att_size, fuse_proj, packed))
+		self.grad_checkpoint = grad_checkpoint
 
+		self.net_schema = net_schema
+		self.att_collector = None
 
 		self.embd2class = nn.ParameterDict()
 		self.bias = nn.ParameterDict()
@@ -34,56 +43,72 @@ class HGCN(nn.Module):
 			nn.init.xavier_uniform_(self.bias[k].data, gain=1.414)
 
 
-	def forward(self, ft_dict, adj_dict):
-
-		x_dict = self.hgc1(ft_dict, adj_dict)
-		x_dict = self.non_linear(x_dict)
-		x_dict = self.dropout_ft(x_dict, 0.5)
-		
-		x_dict = self.hgc2(x_dict, adj_dict)
-		x_dict = self.non_linear(x_dict)
-		x_dict = self.dropout_ft(x_dict, 0.5)
-		
-		x_dict = self.hgc3(x_dict, adj_dict)
-		x_dict = self.non_linear(x_dict)
-		x_dict = self.dropout_ft(x_dict, 0.5)
-		
-		x_dict = self.hgc4(x_dict, adj_dict)
-
+	def register_attention_collector(self, collector):
+		"""Send the type attention of every layer to collector (None switches it off)"""
+		self.att_collector = collector
+		for layer_idx, hgc in enumerate(self.hgc):
+			for agg in hgc.hete_agg.values():
+				agg.att_collector = collector
+				agg.layer_idx = layer_idx
 
-		# x_dict = self.non_linear(x_dict)
-		# x_dict = self.dropout_ft(x_dict, 0.5)
 
-		# x_dict = self.hgc5(x_dict, adj_dict)
-		# x_dict = self.non_linear(x_dict)
-		# x_dict = self.dropout_ft(x_dict, 0.5)
-
-		# x_dict = self.hgc6(x_dict, adj_dict)
-		# x_dict = self.non_linear(x_dict)
-		# x_dict = self.dropout_ft(x_dict, 0.5)
-
-		# x_dict = self.hgc7(x_dict, adj_dict)
-		# x_dict = self.non_linear(x_dict)
-		# x_dict = self.dropout_ft(x_dict, 0.5)
-
-		# x_dict = self.hgc8(x_dict, adj_dict)
-		# x_dict = self.non_linear(x_dict)
-		# x_dict = self.dropout_ft(x_dict, 0.5)
-
-		# x_dict = self.hgc9(x_dict, adj_dict)
+	def forward(self, ft_dict, adj_dict, prop_dict=None):
 
+		# adj_dict is either the full graph or the list of sampled blocks, one per layer
+		if isinstance(adj_dict, list):
+			adj_list = adj_dict
+		else:
+			adj_list = [adj_dict] * len(self.hgc)
 
+		# prop_dict is the first layer propagation of a pruned forward, from bound_rows
+		if prop_dict is None and self.is_bound(ft_dict):
+			prop_dict = self.prop_dict
 
+		x_dict = ft_dict
+		for i in range(len(self.hgc)):
+			layer_prop = prop_dict if i == 0 else None
+			if self.grad_checkpoint and self.training:
+				x_dict = self.checkpoint_layer(i, x_dict, adj_list[i], layer_prop)
+			else:
+				x_dict = self.layer(i, x_dict, adj_list[i], layer_prop)
 
 		logits = {}
 		embd = {}
 		for k in self.label_keys:
 			embd[k] = x_dict[k]
 			logits[k] = torch.mm(x_dict[k], self.embd2class[k]) + self.bias[k]
+
+		if self.att_collector is not None and self.training:
+			self.att_collector.step()
 		return logits, embd
 
 
+	def layer(self, i, x_dict, adj_dict, prop_dict=None):
+		x_dict = self.hgc[i](x_dict, adj_dict, prop_dict)
+		if i < len(self.hgc) - 1:
+			x_dict = self.non_linear(x_dict)
+			x_dict = self.dropout_ft(x_dict, 0.5)
+		return x_dict
+
+
+	def checkpoint_layer(self, i, x_dict, adj_dict, prop_dict=None):
+		"""Run layer i without storing its intermediates, recomputing them in backward"""
+		recompute = [False]
+		def run_layer(x_dict):
+			# the attention of the recomputation in backward was already recorded in forward
+			if self.att_collector is not None:
+				self.att_collector.muted = recompute[0]
+			y_dict = self.layer(i, x_dict, adj_dict, prop_dict)
+			if self.att_collector is not None:
+				self.att_collector.muted = False
+			recompute[0] = True
+			return y_dict
+		return checkpoint(run_layer, x_dict, use_reentrant=False)
+
+
 	def non_linear(self, x_dict):
+		if isinstance(x_dict, PackedDict):
+			return x_dict.apply(F.elu)
 		y_dict = {}
 		for k in x_dict:
 			y_dict[k] = F.elu(x_dict[k])
@@ -91,6 +116,8 @@ class HGCN(nn.Module):
 
 
 	def dropout_ft(self, x_dict, dropout):
+		if isinstance(x_dict, PackedDict):
+			return x_dict.apply(lambda data: F.dropout(data, dropout, training=self.training))
 		y_dict = {}
 		for k in x_dict:
 			y_dict[k] = F.dropout(x_dict[k], dropout, training=self.training)
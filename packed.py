@@ -0,0 +1,44 @@
+from collections.abc import Mapping
+
+import torch
+
+
+
+class PackedDict(Mapping):
+	"""Hidden states of every node type stored in one contiguous tensor.
+
+	offsets maps each node type to its (start, end) rows in data: indexing returns
+	a zero-copy view, so PackedDict stands in for the usual x_dict while elementwise
+	stages run once over the whole buffer through apply.
+	"""
+
+	def __init__(self, data, offsets):
+		self.data = data
+		self.offsets = offsets
+
+
+	@classmethod
+	def pack(cls, x_dict):
+		offsets = {}
+		start = 0
+		for k in x_dict:
+			offsets[k] = (start, start + x_dict[k].shape[0])
+			start += x_dict[k].shape[0]
+		return cls(torch.cat(list(x_dict.values()), 0), offsets)
+
+
+	def apply(self, fn):
+		return PackedDict(fn(self.data), self.offsets)
+
+
+	def __getitem__(self, k):
+		start, end = self.offsets[k]
+		return self.data[start: end]
+
+
+	def __iter__(self):
+		return iter(self.offsets)
+
+
+	def __len__(self):
+		return len(self.offsets)
@@ -0,0 +1,69 @@
+import torch
+
+
+
+def propagate(ft_dict, adj_dict, net_schema):
+	"""Compute A_k x_k once for every relation of net_schema"""
+	prop_dict = {}
+	with torch.no_grad():
+		for curr_k in net_schema:
+			prop_dict[curr_k] = {}
+			for k in net_schema[curr_k]:
+				prop_dict[curr_k][k] = torch.spmm(adj_dict[curr_k][k], ft_dict[k])
+	return prop_dict
+
+
+
+class BoundPropagation:
+	"""Mixin of the models that reuse the first layer propagation of fixed input features.
+
+	The model class provides net_schema and reads prop_dict in its forward pass.
+	"""
+
+	bound_ft = None
+	prop_dict = None
+
+
+	def bind(self, ft_dict, adj_dict):
+		"""Precompute the first layer neighbor propagation of fixed input features.
+
+		Call it once the features and adjacencies are on their final device: every
+		forward pass that receives these same feature tensors reuses A_k x_k.
+		"""
+		self.bound_ft = dict(ft_dict)
+		self.prop_dict = propagate(ft_dict, adj_dict, self.net_schema)
+
+
+	def unbind(self):
+		self.bound_ft = None
+		self.prop_dict = None
+
+
+	def bound_rows(self, nodes):
+		"""Rows nodes[curr_k] of the precomputed A_k x_k, the first layer propagation of a
+		pruned forward whose first block outputs these nodes (see receptive_field)"""
+		return dict([(curr_k, dict([(k, prop[nodes[curr_k].to(prop.device)]) for k, prop in self.prop_dict[curr_k].items()]))
+			for curr_k in self.prop_dict])
+
+
+	def is_bound(self, ft_dict):
+		return self.bound_ft is not None and ft_dict.keys() == self.bound_ft.keys() and \
+			all(ft_dict[k] is self.bound_ft[k] for k in ft_dict)
+
+
+
+def sign_features(ft_dict, adj_dict, hops):
+	"""SIGN-style feature stack: concatenate, for every node type, its raw features
+	and the features propagated along every relation path of length 1..hops"""
+	hop_ft = dict(ft_dict)
+	stack = dict([(k, [ft_dict[k]]) for k in ft_dict])
+	with torch.no_grad():
+		for _ in range(hops):
+			next_ft = {}
+			for curr_k in adj_dict:
+				nb_list = [k for k in adj_dict[curr_k] if k in hop_ft]
+				if nb_list:
+					next_ft[curr_k] = torch.cat([torch.spmm(adj_dict[curr_k][k], hop_ft[k]) for k in nb_list], 1)
+					stack[curr_k].append(next_ft[curr_k])
+			hop_ft = next_ft
+	return dict([(k, torch.cat(stack[k], 1)) for k in stack])
@@ -0,0 +1,59 @@
+import json
+import os
+
+import torch
+
+
+
+def write_atomic(path, text):
+	tmp_path = path + '.tmp'
+	with open(tmp_path, 'w') as out_file:
+		out_file.write(text)
+	os.replace(tmp_path, path)
+
+
+
+class ResultsWriter:
+	"""Write the test results of one run as <run_name>_predictions.jsonl and <run_name>_metrics.json.
+
+	The predictions file has one line per test node: its index, true label, predicted
+	class and the probability of every class. The predictions are computed once on
+	the device and copied to the host in one batch, so the export is linear in the
+	number of test nodes. The metrics record holds the run parameters, the f1 scores,
+	the per-class scores and the confusion matrix, so runs and sweeps can be compared
+	by loading JSON.
+	"""
+
+	def __init__(self, results_dir, run_name):
+		self.results_dir = results_dir
+		self.run_name = run_name
+		self.predictions_path = os.path.join(results_dir, run_name + '_predictions.jsonl')
+		self.metrics_path = os.path.join(results_dir, run_name + '_metrics.json')
+
+
+	def write(self, idx, y, log_probs, metrics, params=None):
+		"""Write the results of the nodes idx: labels y, [N, C] log probabilities and their ConfusionMatrix"""
+		os.makedirs(self.results_dir, exist_ok=True)
+
+		probs = log_probs.detach().exp()
+		columns = torch.stack([idx.to(y.device), y, probs.argmax(1)], 1).cpu().tolist()
+		scores = probs.cpu().tolist()
+		write_atomic(self.predictions_path, ''.join([
+			json.dumps({'node': node, 'label': label, 'prediction': prediction, 'scores': node_scores}) + '\n'
+			for (node, label, prediction), node_scores in zip(columns, scores)]))
+
+		f1_micro, f1_macro = metrics.f1()
+		precision, recall, f1, support = metrics.per_class()
+		record = {
+			'run': self.run_name,
+			'params': params or {},
+			'micro_f1': f1_micro.item(),
+			'macro_f1': f1_macro.item(),
+			'precision': precision.tolist(),
+			'recall': recall.tolist(),
+			'f1': f1.tolist(),
+			'support': [int(count) for count in support.tolist()],
+			'confusion_matrix': metrics.counts[0].tolist(),
+		}
+		write_atomic(self.metrics_path, json.dumps(record, indent=1))
+		return record
@@ -0,0 +1,114 @@
+import numpy as np
+import scipy.sparse as sp
+import torch
+
+from sparse_util import sp_tensor_2_sp_csr, sp_csr_2_sp_tensor
+
+
+
+def slice_features(ft_dict, input_nodes):
+	"""Gather the input features of the nodes a mini-batch reads"""
+	return dict([(k, ft_dict[k][input_nodes[k].to(ft_dict[k].device)]) for k in input_nodes])
+
+
+
+def blocks_to(blocks, device):
+	return [dict([(k, dict([(kk, block[k][kk].to(device)) for kk in block[k]])) for k in block]) for block in blocks]
+
+
+
+def receptive_field(adj_dict, target_k, idx, num_layers):
+	"""Exact num_layers-hop frontier of the target nodes idx.
+
+	Returns the input nodes and per-layer blocks of a forward pass that computes,
+	in every layer, only the rows the target nodes depend on: its target logits
+	equal the rows idx of the full forward. The output nodes of the first block are
+	returned too, so the first layer can read their rows of a precomputed A_k x_k.
+	"""
+	idx = np.asarray(idx.cpu() if torch.is_tensor(idx) else idx, dtype=np.int64)
+	input_nodes, blocks = NeighborSampler(adj_dict, [None] * num_layers).sample(target_k, idx)
+	# the output nodes of every type are its first input nodes, one per row of its relations
+	first_nodes = dict([(k, input_nodes[k][:next(iter(blocks[0][k].values())).shape[0]]) for k in blocks[0] if blocks[0][k]])
+	return input_nodes, blocks, first_nodes
+
+
+
+class NeighborSampler:
+	"""Sample per-relation neighborhoods layer by layer, starting from a batch of target nodes.
+
+	fanouts holds the number of neighbors sampled per node and relation for every
+	layer, first layer first; None keeps every neighbor. Each sampled layer is a
+	block adj_dict whose rows are the layer's output nodes and whose columns are its
+	input nodes, the output nodes of every type being the first input nodes of
+	that type, so the existing HeteGCNLayer runs on it unchanged.
+	"""
+
+	def __init__(self, adj_dict, fanouts, seed=None):
+		self.adj_dict = dict([(k, dict([(kk, sp_tensor_2_sp_csr(adj_dict[k][kk])) for kk in adj_dict[k]])) for k in adj_dict])
+		self.fanouts = fanouts
+		self.rng = np.random.default_rng(seed)
+
+
+	def batches(self, target_k, idx, batch_size, shuffle=True):
+		idx = np.asarray(idx.cpu() if torch.is_tensor(idx) else idx, dtype=np.int64)
+		if shuffle:
+			idx = self.rng.permutation(idx)
+		for start in range(0, len(idx), batch_size):
+			seeds = idx[start: start+batch_size]
+			input_nodes, blocks = self.sample(target_k, seeds)
+			yield torch.from_numpy(seeds), input_nodes, blocks
+
+
+	def sample(self, target_k, seeds):
+		"""Return the input nodes of every type and the block adj_dict of every layer"""
+		dst = dict([(k, np.empty(0, dtype=np.int64)) for k in self.adj_dict])
+		dst[target_k] = np.asarray(seeds, dtype=np.int64)
+
+		blocks = []
+		for fanout in reversed(self.fanouts):
+			block, dst = self.sample_layer(dst, fanout)
+			blocks.insert(0, block)
+
+		input_nodes = dict([(k, torch.from_numpy(dst[k])) for k in dst])
+		return input_nodes, blocks
+
+
+	def sample_layer(self, dst, fanout):
+		rel_list = []
+		for curr_k in self.adj_dict:
+			for k in self.adj_dict[curr_k]:
+				sub_A = self.sample_rows(self.adj_dict[curr_k][k][dst[curr_k]], fanout)
+				rel_list.append((curr_k, k, sub_A))
+
+		src = {}
+		for k in dst:
+			nb_ids = [sub_A.indices for _, nb_k, sub_A in rel_list if nb_k == k]
+			new_ids = np.setdiff1d(np.concatenate(nb_ids), dst[k]) if nb_ids else np.empty(0, dtype=np.int64)
+			src[k] = np.concatenate((dst[k], new_ids.astype(np.int64)))
+
+		block = dict([(k, {}) for k in self.adj_dict])
+		for curr_k, k, sub_A in rel_list:
+			order = np.argsort(src[k], kind='stable')
+			local_col = order[np.searchsorted(src[k], sub_A.indices, sorter=order)]
+			sub_A = sp.csr_matrix((sub_A.data, local_col, sub_A.indptr), shape=(len(dst[curr_k]), len(src[k])))
+			block[curr_k][k] = sp_csr_2_sp_tensor(sub_A)
+
+		return block, src
+
+
+	def sample_rows(self, sub_A, fanout):
+		"""Keep at most fanout random entries per row, rescaled to the original row total"""
+		deg = np.diff(sub_A.indptr)
+		if fanout is None or deg.max(initial=0) <= fanout:
+			return sub_A
+
+		row = np.repeat(np.arange(sub_A.shape[0]), deg)
+		order = np.lexsort((self.rng.random(len(row)), row))
+		rank = np.arange(len(row)) - sub_A.indptr[row[order]]
+		keep = np.sort(order[rank < fanout])
+		kept_A = sp.csr_matrix((sub_A.data[keep], (row[keep], sub_A.indices[keep])), shape=sub_A.shape)
+
+		row_total = np.asarray(sub_A.sum(1)).ravel()
+		kept_total = np.asarray(kept_A.sum(1)).ravel()
+		scale = np.divide(row_total, kept_total, out=np.zeros_like(row_total), where=kept_total != 0)
+		return sp.csr_matrix(sp.diags(scale.astype(np.float32)).dot(kept_A))
@@ -0,0 +1,23 @@
+import numpy as np
+import scipy.sparse as sp
+import torch
+
+
+
+def sp_tensor_2_sp_csr(sp_tensor):
+	"""Convert a torch sparse tensor to a scipy CSR matrix."""
+	sp_tensor = sp_tensor.detach().cpu()
+	if sp_tensor.layout == torch.sparse_csr:
+		return sp.csr_matrix((sp_tensor.values().numpy(), sp_tensor.col_indices().numpy(), sp_tensor.crow_indices().numpy()), shape=tuple(sp_tensor.shape))
+	sp_tensor = sp_tensor.coalesce()
+	indices = sp_tensor.indices().numpy()
+	return sp.csr_matrix((sp_tensor.values().numpy(), (indices[0], indices[1])), shape=tuple(sp_tensor.shape))
+
+
+
+def sp_csr_2_sp_tensor(sp_csr_mat):
+	"""Convert a scipy CSR matrix to a torch sparse tensor."""
+	row = np.repeat(np.arange(sp_csr_mat.shape[0], dtype=np.int64), np.diff(sp_csr_mat.indptr))
+	indices = torch.from_numpy(np.vstack((row, sp_csr_mat.indices.astype(np.int64))))
+	values = torch.from_numpy(sp_csr_mat.data.astype(np.float32))
+	return torch.sparse_coo_tensor(indices, values, sp_csr_mat.shape)
@@ -0,0 +1,111 @@
+import hashlib
+import itertools
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+import torch
+
+
+
+def expand_grid(grids):
+	"""Jobs of a declarative grid: every combination of the value lists of a
+	{name: [values]} dict, for one dict or a list of them"""
+	if isinstance(grids, dict):
+		grids = [grids]
+	jobs = []
+	for grid in grids:
+		names = list(grid)
+		for values in itertools.product(*[grid[name] for name in names]):
+			jobs.append(dict(zip(names, values)))
+	return jobs
+
+
+
+def job_key(job):
+	return json.dumps(job, sort_keys=True)
+
+
+
+def job_hash(job):
+	"""Short digest of job_key, to tell the files of different jobs apart"""
+	return hashlib.sha1(job_key(job).encode()).hexdigest()[:12]
+
+
+
+def set_num_threads(num_threads):
+	torch.set_num_threads(num_threads)
+
+
+
+def run_job(train_fn, job):
+	"""Run one job in a worker: a failing job returns its error instead of raising"""
+	try:
+		return job, train_fn(**job), None
+	except Exception as error:
+		return job, None, '{}: {}'.format(type(error).__name__, error)
+
+
+
+class Sweep:
+	"""Run the jobs of a grid in a process pool and collect their results.
+
+	Every finished job is appended to the JSONL file results_path as soon as it
+	completes, and the table of all the results (one row per job, its parameters
+	followed by its metrics) is rewritten next to it as a CSV. Jobs already in
+	results_path are skipped, so a stopped sweep resumes where it left off. A job
+	that raises is recorded with its error instead of a result and the other jobs go
+	on; failed jobs are run again on the next run.
+	"""
+
+	def __init__(self, train_fn, results_path, workers=None, threads_per_worker=4):
+		self.train_fn = train_fn
+		self.results_path = results_path
+		self.table_path = os.path.splitext(results_path)[0] + '.csv'
+		self.threads_per_worker = threads_per_worker
+		self.workers = workers or max(1, (os.cpu_count() or 1) // threads_per_worker)
+
+
+	def load_results(self):
+		if not os.path.exists(self.results_path):
+			return []
+		with open(self.results_path) as in_file:
+			return [json.loads(line) for line in in_file if line.strip()]
+
+
+	def run(self, jobs):
+		done = set(job_key(record['job']) for record in self.load_results() if 'error' not in record)
+		pending = [job for job in jobs if job_key(job) not in done]
+		print('sweep: ', len(jobs) - len(pending), 'jobs done,', len(pending), 'to run on', self.workers, 'workers')
+
+		os.makedirs(os.path.dirname(os.path.abspath(self.results_path)), exist_ok=True)
+		# spawn, not fork: the workers must not inherit the thread pools of the parent
+		context = multiprocessing.get_context('spawn')
+		with ProcessPoolExecutor(self.workers, mp_context=context, initializer=set_num_threads, initargs=(self.threads_per_worker,)) as pool:
+			futures = [pool.submit(run_job, self.train_fn, job) for job in pending]
+			for future in as_completed(futures):
+				try:
+					job, result, error = future.result()
+				except Exception:
+					# the pool itself broke (a worker died): drop the queued jobs rather than wait for them
+					for queued in futures:
+						queued.cancel()
+					raise
+				record = {'job': job, 'result': result} if error is None else {'job': job, 'error': error}
+				if error is not None:
+					print('sweep: job failed:', job_key(job), error)
+				with open(self.results_path, 'a') as out_file:
+					out_file.write(json.dumps(record) + '\n')
+				self.write_table()
+
+		return self.write_table()
+
+
+	def write_table(self):
+		"""The table of the jobs with a result, the last one of a job that ran more than once"""
+		results = dict([(job_key(record['job']), record) for record in self.load_results() if 'error' not in record])
+		table = pd.DataFrame([dict(record['job'], **record['result']) for record in results.values()])
+		table.to_csv(self.table_path, index=False)
+		return table
@@ -0,0 +1,96 @@
+import json
+
+import torch
+
+
+
+class MemorySink:
+	"""Keep the flushed attention records in a list"""
+
+	def __init__(self):
+		self.records = []
+
+	def write(self, records):
+		self.records.extend(records)
+
+
+
+class FileSink:
+	"""Append the flushed attention records to a JSON lines file"""
+
+	def __init__(self, path):
+		self.path = path
+
+	def write(self, records):
+		with open(self.path, 'a') as out_file:
+			for record in records:
+				out_file.write(json.dumps(record) + '\n')
+
+
+
+class AttentionCollector:
+	"""Accumulate the per-layer, per-type mean type attention on the model device.
+
+	Register it with HGCN.register_attention_collector. The running sums stay on
+	the device and are copied to the host only every `interval` training forward
+	passes, when the mean over the window is written to the sink. Evaluation
+	passes are not recorded.
+	"""
+
+	def __init__(self, sink=None, interval=50):
+		self.sink = sink if sink is not None else MemorySink()
+		self.interval = interval
+		self.step_num = 0
+		self.muted = False
+		self._sum = {}
+		self._count = {}
+		self._nb_name = {}
+
+
+	def record(self, layer_idx, curr_k, nb_name, attention):
+		# a pruned forward computes no rows of the types the loss does not read
+		if self.muted or attention.shape[0] == 0:
+			return
+		key = (layer_idx, curr_k)
+		att_mean = attention.detach().mean(0)
+		if key in self._sum:
+			self._sum[key] += att_mean
+			self._count[key] += 1
+		else:
+			self._sum[key] = att_mean.clone()
+			self._count[key] = 1
+			self._nb_name[key] = list(nb_name)
+
+
+	def step(self):
+		if self.muted:
+			return
+		self.step_num += 1
+		if self.interval > 0 and self.step_num % self.interval == 0:
+			self.flush()
+
+
+	def flush(self):
+		if not self._sum:
+			return
+		keys = list(self._sum.keys())
+		# a single device-to-host copy for the whole window
+		att_means = torch.cat([self._sum[key] / self._count[key] for key in keys]).tolist()
+
+		records = []
+		start = 0
+		for key in keys:
+			nb_name = self._nb_name[key]
+			records.append({
+				'step': self.step_num,
+				'layer': key[0],
+				'type': key[1],
+				'passes': self._count[key],
+				'attention': dict(zip(nb_name, att_means[start: start+len(nb_name)])),
+			})
+			start += len(nb_name)
+
+		self._sum = {}
+		self._count = {}
+		self.sink.write(records)
+
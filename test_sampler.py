@@ -0,0 +1,57 @@
+import numpy as np
+import scipy.sparse as sp
+import torch
+
+from ensemble import HGCNEnsemble
+from model import HGCN, build_net_schema
+from sampler import receptive_field, slice_features
+from sparse_util import sp_csr_2_sp_tensor
+
+
+
+def empty_relation_graph():
+	"""Types a (16 nodes) and b (11 nodes): a reads a and b, and the only relation of b, b->a, has no edge"""
+	rng = np.random.default_rng(0)
+	ft_dict = {'a': torch.randn(16, 5), 'b': torch.randn(11, 3)}
+	a_a = sp.random(16, 16, density=0.1, format='csr', random_state=rng, dtype=np.float32)
+	a_b = sp.random(16, 11, density=0.2, format='csr', random_state=rng, dtype=np.float32)
+	adj_dict = {
+		'a': {'a': sp_csr_2_sp_tensor(a_a), 'b': sp_csr_2_sp_tensor(a_b)},
+		'b': {'a': sp_csr_2_sp_tensor(sp.csr_matrix((11, 16), dtype=np.float32))},
+	}
+	return ft_dict, adj_dict
+
+
+
+def layer_shape(ft_dict):
+	return [dict([(k, ft_dict[k].shape[1]) for k in ft_dict]), {'a': 8, 'b': 8}, {'a': 8, 'b': 8}, {'a': 4, 'b': 4}]
+
+
+
+def test_receptive_field_with_empty_relation():
+	ft_dict, adj_dict = empty_relation_graph()
+	net_schema = build_net_schema(adj_dict)
+	assert net_schema['b'] == []
+
+	torch.manual_seed(0)
+	model = HGCN(net_schema, layer_shape(ft_dict), ['a'])
+	model.eval()
+	idx = torch.tensor([1, 4, 9, 15])
+	input_nodes, blocks, _ = receptive_field(adj_dict, 'a', idx, 2)
+	with torch.no_grad():
+		full = model(ft_dict, adj_dict)[0]['a'][idx]
+		pruned = model(slice_features(ft_dict, input_nodes), blocks)[0]['a']
+	assert torch.allclose(pruned, full, atol=1e-5)
+
+
+
+def test_ensemble_receptive_field_with_empty_relation():
+	ft_dict, adj_dict = empty_relation_graph()
+	model = HGCNEnsemble([0, 1], build_net_schema(adj_dict), layer_shape(ft_dict), ['a'])
+	model.eval()
+	idx = torch.tensor([1, 4, 9, 15])
+	input_nodes, blocks, _ = receptive_field(adj_dict, 'a', idx, 2)
+	with torch.no_grad():
+		full = model(ft_dict, adj_dict)[0]['a'][:, idx]
+		pruned = model(slice_features(ft_dict, input_nodes), blocks)[0]['a']
+	assert torch.allclose(pruned, full, atol=1e-5)
@@ -0,0 +1,20 @@
+import numpy as np
+
+from twitter_util_preprocessing import align_features, standardize_
+
+
+def test_memmap_features_match_in_memory(tmp_path):
+    """build_twitter_features(dim, memmap=True) assembles the same features in a memory-mapped file"""
+    rng = np.random.default_rng(0)
+    ids = rng.permutation(10)
+    user_ids = [ids[:6], ids[6:]]
+    embeddings = [rng.normal(3, 2, (6, 4)), rng.normal(3, 2, (4, 4))]
+
+    in_memory = standardize_(align_features(user_ids, embeddings), chunk_size=3)
+    out = np.lib.format.open_memmap(str(tmp_path / 'ft_u.tmp.npy'), mode='w+', dtype=np.float32, shape=(10, 4))
+    memmapped = standardize_(align_features(user_ids, embeddings, out), chunk_size=3)
+
+    assert memmapped is out
+    np.testing.assert_array_equal(np.asarray(memmapped), in_memory)
+    np.testing.assert_allclose(in_memory.mean(0), 0, atol=1e-6)
+    np.testing.assert_allclose(in_memory.std(0), 1, atol=1e-5)
@@ -0,0 +1,206 @@
+import torch
+import torch.nn.functional as F
+
+from checkpoint import rng_state, set_rng_state
+from ensemble import ensemble_nll_loss
+from metrics import ConfusionMatrix
+from sampler import slice_features, blocks_to
+
+
+
+class Trainer:
+	"""Train an HGCN (or an HGCNEnsemble) on the labelled nodes of one node type.
+
+	Every epoch is one full-batch step, one step on the pruned train_field, or one
+	pass over the mini-batches of sampler. Every val_interval epochs the nodes val_idx
+	are evaluated under torch.inference_mode(); when the validation f1 named by
+	monitor ('micro' or 'macro') has not improved for patience evaluations,
+	training stops and the weights of the best evaluation are restored. The training
+	scores stay on the device and are only printed every log_interval epochs. With a
+	Checkpointer the whole training state is saved every checkpointer.interval
+	epochs, and resume() continues a run from its last checkpoint.
+	"""
+
+	def __init__(self, model, optimizer, ft_dict, adj_dict, target_k, y, train_idx, val_idx=None,
+				train_field=None, sampler=None, batch_size=0, val_interval=1, patience=0, monitor='micro', log_interval=1,
+				checkpointer=None):
+		self.model = model
+		self.optimizer = optimizer
+		self.ft_dict = ft_dict
+		self.adj_dict = adj_dict
+		self.target_k = target_k
+		self.y = y
+		self.train_idx = train_idx
+		self.val_idx = val_idx
+		self.train_field = train_field
+		self.sampler = sampler
+		self.batch_size = batch_size
+		self.val_interval = val_interval
+		self.patience = patience
+		self.monitor = monitor
+		self.log_interval = log_interval
+		self.checkpointer = checkpointer
+
+		self.epoch = 0
+		self.best_f1 = None
+		self.best_epoch = None
+		self.best_state = None
+		self.bad_evals = 0
+
+
+	def log_softmax(self, logits):
+		return F.log_softmax(logits[self.target_k], dim=-1)
+
+
+	def loss(self, x, y):
+		# an ensemble returns [R, N, C] logits: sum the losses of its replicas
+		return ensemble_nll_loss(x, y) if x.dim() == 3 else F.nll_loss(x, y)
+
+
+	def f1(self, metrics):
+		"""Micro and macro f1 of a confusion matrix, averaged over the replicas of an ensemble"""
+		return [score.mean().item() for score in metrics.f1()]
+
+
+	def train_sampled(self):
+		"""One pass over the training nodes in neighbor-sampled mini-batches"""
+		device = self.y.device
+		loss_sum, metrics = 0, None
+		for seeds, input_nodes, blocks in self.sampler.batches(self.target_k, self.train_idx, self.batch_size):
+			self.optimizer.zero_grad()
+			seeds = seeds.to(device)
+			logits, _ = self.model(slice_features(self.ft_dict, input_nodes), blocks_to(blocks, device))
+
+			x_batch = self.log_softmax(logits)
+			y_batch = self.y[seeds]
+			loss_batch = self.loss(x_batch, y_batch)
+			loss_batch.backward()
+			self.optimizer.step()
+
+			loss_sum = loss_sum + loss_batch.detach() * len(seeds)
+			metrics = ConfusionMatrix.of(y_batch, x_batch) if metrics is None else metrics.update(y_batch, x_batch)
+
+		return loss_sum / len(self.train_idx), metrics
+
+
+	def train_step(self):
+		"""One training epoch: returns the loss and the confusion matrix of the training nodes"""
+		self.model.train()
+		if self.sampler is not None:
+			return self.train_sampled()
+
+		self.optimizer.zero_grad()
+		if self.train_field is not None:
+			# the pruned forward computes exactly the training nodes, in order
+			logits, _ = self.model(*self.train_field)
+			x_train = self.log_softmax(logits)
+		else:
+			logits, _ = self.model(self.ft_dict, self.adj_dict)
+			x_train = self.log_softmax(logits)[..., self.train_idx, :]
+		y_train = self.y[self.train_idx]
+		loss_train = self.loss(x_train, y_train)
+
+		loss_train.backward()
+		self.optimizer.step()
+		return loss_train.detach(), ConfusionMatrix.of(y_train, x_train)
+
+
+	def predict(self, idx=None):
+		"""Log probabilities of the nodes idx (all of them by default), without autograd"""
+		self.model.eval()
+		with torch.inference_mode():
+			logits, _ = self.model(self.ft_dict, self.adj_dict)
+			x = self.log_softmax(logits)
+			return x if idx is None else x[..., idx, :]
+
+
+	def validate(self):
+		"""Evaluate the validation nodes, keeping the best weights; False once patience ran out"""
+		f1_micro, f1_macro = self.f1(ConfusionMatrix.of(self.y[self.val_idx], self.predict(self.val_idx)))
+		val_f1 = f1_micro if self.monitor == 'micro' else f1_macro
+		if self.best_f1 is None or val_f1 > self.best_f1:
+			self.best_f1 = val_f1
+			self.best_epoch = self.epoch
+			# the best weights are only restored by early stopping
+			if self.patience > 0:
+				self.best_state = dict([(name, value.detach().clone()) for name, value in self.model.state_dict().items()])
+			self.bad_evals = 0
+		else:
+			self.bad_evals += 1
+		return f1_micro, f1_macro, not (self.patience > 0 and self.bad_evals >= self.patience)
+
+
+	def state_dict(self):
+		"""Everything a run needs to continue exactly where it stopped"""
+		state = {
+			'epoch': self.epoch,
+			'model': self.model.state_dict(),
+			'optimizer': self.optimizer.state_dict(),
+			'rng': rng_state(),
+			'best_f1': self.best_f1,
+			'best_epoch': self.best_epoch,
+			'best_state': self.best_state,
+			'bad_evals': self.bad_evals,
+		}
+		if self.sampler is not None:
+			state['sampler_rng'] = self.sampler.rng.bit_generator.state
+		return state
+
+
+	def load_state_dict(self, state):
+		self.epoch = state['epoch']
+		self.model.load_state_dict(state['model'])
+		self.optimizer.load_state_dict(state['optimizer'])
+		set_rng_state(state['rng'])
+		self.best_f1 = state['best_f1']
+		self.best_epoch = state['best_epoch']
+		self.best_state = state['best_state']
+		self.bad_evals = state['bad_evals']
+		if self.sampler is not None:
+			self.sampler.rng.bit_generator.state = state['sampler_rng']
+
+
+	def resume(self):
+		"""Load the last checkpoint if there is one; True when the run was resumed"""
+		state = self.checkpointer.load() if self.checkpointer is not None else None
+		if state is None:
+			return False
+		self.load_state_dict(state)
+		print('resuming from', self.checkpointer.checkpoint_path, 'at epoch', self.epoch)
+		return True
+
+
+	def fit(self, epochs):
+		keep_going = not (self.patience > 0 and self.bad_evals >= self.patience)
+		while self.epoch < epochs and keep_going:
+			loss_train, metrics_train = self.train_step()
+			log = []
+			if (self.epoch + 1) % self.log_interval == 0:
+				f1_micro_train, f1_macro_train = self.f1(metrics_train)
+				log += [
+					'train loss: {:.4f}'.format(loss_train.item()),
+					'train micro f1 {}: {:.4f}'.format(self.target_k, f1_micro_train),
+					'train macro f1 {}: {:.4f}'.format(self.target_k, f1_macro_train),
+				]
+
+			if self.val_idx is not None and (self.epoch + 1) % self.val_interval == 0:
+				f1_micro_val, f1_macro_val, keep_going = self.validate()
+				log += [
+					'val micro f1 {}: {:.4f}'.format(self.target_k, f1_micro_val),
+					'val macro f1 {}: {:.4f}'.format(self.target_k, f1_macro_val),
+				]
+			if log:
+				print('epoch: {:3d}'.format(self.epoch), *log)
+			self.epoch += 1
+			if self.checkpointer is not None and self.checkpointer.due(self.epoch):
+				self.checkpointer.save(self.state_dict())
+
+		if self.checkpointer is not None:
+			if not self.checkpointer.due(self.epoch):
+				self.checkpointer.save(self.state_dict())
+			self.checkpointer.wait()
+		if not keep_going:
+			print('early stopping at epoch', self.epoch - 1)
+		if self.patience > 0 and self.best_state is not None:
+			print('restoring the weights of epoch', self.best_epoch, '(val ' + self.monitor + ' f1: {:.4f})'.format(self.best_f1))
+			self.model.load_state_dict(self.best_state)
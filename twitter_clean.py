@@ -5,9 +5,8 @@ import os
 
 import sys
 
+from edge_store import EdgeStore
 
-def filter_array_with_treshold(array, treshold):
-	return array[array[:, 2] > treshold]
 
 def launch_twitter_clean(network_type, treshold=-1):
 	#np.set_printoptions(threshold=np.inf)
@@ -15,33 +14,36 @@ def launch_twitter_clean(network_type, treshold=-1):
 	# load data from txt
 	current_dir = os.path.dirname(os.path.abspath(__file__))
 
-	# load data from txt
-	sn_twitter_path = os.path.join(current_dir, 'twitter_dataset', 'full_'+ network_type + '_network.txt')
-	
-	sn_uu = np.genfromtxt(sn_twitter_path, delimiter='\t', dtype=np.float32)
+	if network_type == 'no':
+		# no network involved: an empty relation, which the model drops from its schema
+		sn_uu_0, sn_uu_1, sn_uu_2 = np.empty(0, dtype=np.int32), np.empty(0, dtype=np.int32), np.empty(0, dtype=np.float32)
+	else:
+		# load data from txt, parsed once into a binary edge store sorted by weight
+		sn_twitter_path = os.path.join(current_dir, 'twitter_dataset', 'full_'+ network_type + '_network.txt')
+		store = EdgeStore.open(sn_twitter_path, os.path.join(current_dir, 'twitter_dataset', 'edge_store_' + network_type))
 
 	if network_type == 'spatial':
-		# filter the array based on a treshold
-		sn_uu = filter_array_with_treshold(sn_uu, treshold)
+		# keep the edges above the treshold: a suffix of the store
+		sn_uu_0, sn_uu_1, sn_uu_2 = store.above(treshold)
+	elif network_type == 'social':
+		sn_uu_0, sn_uu_1, sn_uu_2 = store.src, store.dst, store.weight
 	
-	print('user_user ' + network_type + ' network shape: ', sn_uu.shape)
+	print('user_user ' + network_type + ' network shape: ', (len(sn_uu_0), 3))
 	# create ids with all the users by using the  entire network and by removing duplicates
-	sn_uu_0 = sn_uu[:, 0].astype(np.int32)
-	sn_uu_1 = sn_uu[:, 1].astype(np.int32)
-	sn_uu_ids = np.array(list(set(np.concatenate([sn_uu_0, sn_uu_1]))))
+	sn_uu_ids = np.unique(np.concatenate([sn_uu_0, sn_uu_1]))
 	sn_uu_num = len(sn_uu_ids)
 
 	# creation of: row, col and data for the creation of a sparse matrix
-	row = sn_uu_0
-	col = sn_uu_1
+	row = np.array(sn_uu_0)
+	col = np.array(sn_uu_1)
 
-	# data is 0 when no network is involved, 1 for social network, while for spatial network is the distance
+	# data is empty when no network is involved, 1 for social network, while for spatial network is the distance
 	if(network_type == 'no'):
 		data = np.zeros(row.shape[0], dtype=np.float32)
 	elif(network_type == 'social'):
 		data = np.ones(row.shape[0], dtype=np.float32)
 	elif(network_type == 'spatial'):
-		data = sn_uu[:, 2].astype(np.float32)
+		data = np.array(sn_uu_2, dtype=np.float32)
 
 	# Load full label in order to get tot num of users, this is needed to create the sparse matrix
 	full_label_path = os.path.join(current_dir, 'twitter_dataset', 'full_label.csv')
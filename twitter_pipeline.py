@@ -1,88 +1,80 @@
+import os
+
+from build_cache import BuildCache
+from hgcn_store import MANIFEST
 from twitter_clean import launch_twitter_clean
-from twitter_util_preprocessing import load_twitter
-from twitter_train import exec_train
-from word2vec_train import trainWord2Vec
+from twitter_util_preprocessing import build_twitter_features, build_twitter_graph
+from util_twitter import twitter_features_path, twitter_graph_path
+from twitter_train import train_job
+from sweep import Sweep, expand_grid
+from word2vec_train import buildCorpus, trainWord2Vecs, w2v_model_path, corpus_dir
 from compute_embeddings import computeW2Vembeddings, twitter4SSEEmbeddings
 
+current_dir = os.path.dirname(os.path.abspath(__file__))
+dataset_dir = os.path.join(current_dir, 'twitter_dataset')
+
+w2v_dims = [128, 256, 512]
+dims = w2v_dims + [768]
+# (network_type, treshold) of every graph of the experiments
+networks = [('no', -1), ('social', -1), ('spatial', 0), ('spatial', 0.49), ('spatial', 0.69)]
+
+
+def dataset_path(*names):
+    return os.path.join(dataset_dir, *names)
+
+
+def embeddings_paths(dim):
+    return [dataset_path('embedded_datasets', str(dim) + '_dim', split + '_embeddings_' + str(dim) + '.pkl') for split in ['train', 'test']]
+
+
+def graph_paths(network_type, treshold):
+    name = str(treshold).replace(".","_") + '_' + network_type
+    return [dataset_path('twitter_sp_uu_' + name + '_adj_mats.pkl'), dataset_path('twitter_' + name + '_uu_ids.pkl')]
+
+
 if __name__ == '__main__':
-    trainW2v = True
-    computeW2vEmbeddings = True
-    cleaning = True
-    loadPklCompute = True
     trainModel = True
+    memmap_features = False # assemble every feature matrix in a memory-mapped file instead of in RAM
+
+    # Every preprocessing stage runs through the build cache: it is skipped when its
+    # outputs exist and its code, parameters and input files did not change since
+    # the last run, so the whole pipeline can always be launched end to end
+    cache = BuildCache(dataset_path('build_cache.json'))
+    train_csv = dataset_path('train.csv')
+    test_csv = dataset_path('test.csv')
+    label_csv = dataset_path('full_label.csv')
+
+    #tokenize the training set once, then train the word2vec model of every dimension concurrently
+    corpus_paths = [os.path.join(corpus_dir, name) for name in ['tokens.npy', 'offsets.npy', 'vocab.json']]
+    cache.run(buildCorpus, inputs=[train_csv], outputs=corpus_paths)
+    cache.run(trainWord2Vecs, w2v_dims, inputs=corpus_paths, outputs=[w2v_model_path(dim) for dim in w2v_dims])
 
-    #train the word2vec model
-    if trainW2v:
-        trainWord2Vec(128)
-        trainWord2Vec(256)
-        trainWord2Vec(512)
-    
     #compute the word2vec and the Twitter4SSE embeddings
-    if computeW2vEmbeddings:
-        computeW2Vembeddings(128)
-        computeW2Vembeddings(256)
-        computeW2Vembeddings(512)
-        twitter4SSEEmbeddings()
+    for dim in w2v_dims:
+        cache.run(computeW2Vembeddings, dim, inputs=[train_csv, test_csv, w2v_model_path(dim)], outputs=embeddings_paths(dim))
+    cache.run(twitter4SSEEmbeddings, inputs=[train_csv, test_csv], outputs=embeddings_paths(768))
 
     # We are going here to launch the first twitter preprocessing
-    if cleaning:
-        launch_twitter_clean('no')
-        launch_twitter_clean('social')
-        launch_twitter_clean('spatial', 0)
-        launch_twitter_clean('spatial', 0.49)
-        launch_twitter_clean('spatial', 0.69)
-
-    # We are going here to launch the second twitter preprocessing
-    if loadPklCompute:
-        load_twitter('no', 128)
-        load_twitter('no', 256)
-        load_twitter('no', 512)
-        load_twitter('no', 768)
-
-        load_twitter('social', 128)
-        load_twitter('social', 256)
-        load_twitter('social', 512)
-        load_twitter('social', 768)
-
-        load_twitter('spatial', 128, 0)
-        load_twitter('spatial', 256, 0)
-        load_twitter('spatial', 512, 0)
-        load_twitter('spatial', 768, 0)
-
-        load_twitter('spatial', 128, 0.49)
-        load_twitter('spatial', 256, 0.49)
-        load_twitter('spatial', 512, 0.49)
-        load_twitter('spatial', 768, 0.49)
-
-        load_twitter('spatial', 128, 0.69)
-        load_twitter('spatial', 256, 0.69)
-        load_twitter('spatial', 512, 0.69)
-        load_twitter('spatial', 768, 0.69)
-
-     # We are going here to launch the twitter train and collect the results
+    for network_type, treshold in networks:
+        cache.run(launch_twitter_clean, network_type, treshold,
+                  inputs=([] if network_type == 'no' else [dataset_path('full_' + network_type + '_network.txt')]) + [label_csv],
+                  outputs=graph_paths(network_type, treshold))
+
+    # We are going here to launch the second twitter preprocessing: every graph and every
+    # feature set is built once, the training loader combines them
+    for network_type, treshold in networks:
+        cache.run(build_twitter_graph, network_type, treshold,
+                  inputs=[graph_paths(network_type, treshold)[0]],
+                  outputs=[os.path.join(twitter_graph_path(network_type, treshold), MANIFEST)])
+    for dim in dims:
+        cache.run(build_twitter_features, dim, memmap_features,
+                  inputs=embeddings_paths(dim) + [label_csv],
+                  outputs=[os.path.join(twitter_features_path(dim), MANIFEST)])
+
+     # We are going here to launch the twitter train and collect the results: the jobs of the
+     # grid run in parallel processes and their scores are gathered in output_twitter/sweep.csv;
+     # a rerun only trains the jobs missing from output_twitter/sweep.jsonl
     if trainModel:
-       
-        exec_train('no', 128)
-        exec_train('no', 256)
-        exec_train('no', 512)
-        exec_train('no', 768)
-
-        exec_train('social', 128)  
-        exec_train('social', 256)
-        exec_train('social', 512)
-        exec_train('social', 768)
-
-        exec_train('spatial', 128, 0)  
-        exec_train('spatial', 256, 0)
-        exec_train('spatial', 512, 0)
-        exec_train('spatial', 768, 0)
-
-        exec_train('spatial', 128, 0.49)  
-        exec_train('spatial', 256, 0.49)
-        exec_train('spatial', 512, 0.49)
-        exec_train('spatial', 768, 0.49)
-
-        exec_train('spatial', 128, 0.69)  
-        exec_train('spatial', 256, 0.69)
-        exec_train('spatial', 512, 0.69)
-        exec_train('spatial', 768, 0.69)
\ No newline at end of file
+        jobs = expand_grid([{'network_type': [network_type], 'treshold': [treshold], 'dim': dims, 'seed': [0]}
+                            for network_type, treshold in networks])
+        Sweep(train_job, os.path.join(current_dir, 'output_twitter', 'sweep.jsonl'), threads_per_worker=4).run(jobs)
@@ -2,65 +2,33 @@ import numpy as np
 import torch
 import torch.nn.functional as F
 import torch.optim as optim
-from sklearn.metrics import f1_score, classification_report
-import warnings
-import sklearn.exceptions
-warnings.filterwarnings("ignore", category=sklearn.exceptions.UndefinedMetricWarning)
 from datetime import datetime
 import time
 from util_twitter import *
-from model import HGCN
-
-def train(epoch):
-
-    model.train()
-    optimizer.zero_grad()
-    logits, _ = model(ft_dict, adj_dict)
-
-    u_logits = F.log_softmax(logits['u'], dim=1)
-    idx_train_u = label['u'][1]
-    x_train_u = u_logits[idx_train_u]
-    y_train_u = label['u'][0][idx_train_u]
-    loss_train = F.nll_loss(x_train_u, y_train_u)
-    f1_micro_train_u = f1_score(y_train_u.data.cpu(), x_train_u.data.cpu().argmax(1), average='micro')
-    f1_macro_train_u = f1_score(y_train_u.data.cpu(), x_train_u.data.cpu().argmax(1), average='macro')
-
-    print(classification_report(y_train_u.data.cpu(), x_train_u.data.cpu().argmax(1)))
-
-    loss_train.backward()
-    optimizer.step()
-
-
-    if epoch % 1 == 0:
-        print(
-            'epoch: {:3d}'.format(epoch),
-            'train loss: {:.4f}'.format(loss_train.item()),
-            'train micro f1 u {:.4f}'.format(f1_micro_train_u.item()),
-            'train macro f1 u: {:.4f}'.format(f1_macro_train_u.item()),
-        )
-
-def test():
-    model.eval()
-    logits, embd = model(ft_dict, adj_dict)
-
-    u_logits = F.log_softmax(logits['u'], dim=1)
+from model import HGCN, build_net_schema
+from propagation import sign_features
+from sampler import NeighborSampler, receptive_field, slice_features, blocks_to
+from trainer import Trainer
+from checkpoint import Checkpointer
+from metrics import ConfusionMatrix
+from results import ResultsWriter
+from telemetry import AttentionCollector, FileSink
+from sweep import job_hash
+
+def run_id(params):
+    """network type, dim, treshold and seed of a run, then the hash of all its parameters:
+    runs of different sweep jobs never share a file"""
+    return '_'.join([params['network_type'], str(params['dim']), str(params['treshold']), str(params['seed']), job_hash(params)])
+
+def test(trainer, label, params):
+    """Test the users of the test split and write their predictions and the metrics of the run"""
     idx_test_u = label['u'][2]
-    x_test_u = u_logits[idx_test_u]
+    x_test_u = trainer.predict(idx_test_u)
     y_test_u = label['u'][0][idx_test_u]
-    f1_micro_test_u = f1_score(y_test_u.data.cpu(), x_test_u.data.cpu().argmax(1), average='micro')
-    f1_macro_test_u = f1_score(y_test_u.data.cpu(), x_test_u.data.cpu().argmax(1), average='macro')
-
-    diff_positions_tmp = (y_test_u.data.cpu() != x_test_u.data.cpu().argmax(1)).nonzero(as_tuple=True)[0]
-    diff_positions = diff_positions_tmp.tolist()
-
-    '''print(diff_positions)
-    print(len(diff_positions))
-    print(1 - len(diff_positions)/len(y_test_u.data.cpu()))
-
-    print(y_test_u.data.cpu()[diff_positions])
-    print(x_test_u.data.cpu().argmax(1).data.cpu()[diff_positions])'''
+    metrics_test = ConfusionMatrix.of(y_test_u, x_test_u)
+    f1_micro_test_u, f1_macro_test_u = metrics_test.f1()
 
-    print(classification_report(y_test_u.data.cpu(), x_test_u.data.cpu().argmax(1)))
+    print(metrics_test.report())
 
     print(
         '\n'+
@@ -69,39 +37,52 @@ def test():
     )
     now = datetime.now()
     string = now.strftime('%Y-%m-%d %H:%M:%S').replace(" ", "-").replace(":", "-")
+    run_name = "out_" + string + "_" + run_id(params)
 
     current_dir = os.path.dirname(os.path.abspath(__file__))
-    file_path = os.path.join(current_dir, "output_twitter/out_" + string + "_"+network_type+"_"+str(dim)+ '_' + str(treshold) + ".txt")
-    with open(file_path, "wb") as fOut:
-        # Writing data to a file
-        fOut.write(('test micro f1 u: {:.4f}'.format(f1_micro_test_u.item())).encode('utf-8'))
-        fOut.write(('\n' + 'test macro f1 u: {:.4f}'.format(f1_macro_test_u.item())).encode('utf-8'))
-        fOut.write(('\n\n ********** \n').encode('utf-8'))
-        fOut.write((classification_report(y_test_u.data.cpu(), x_test_u.data.cpu().argmax(1))).encode('utf-8'))
-        for i in diff_positions:
-            prediction = x_test_u.data.cpu().argmax(1).data.cpu()[i].item()
-            true_label = y_test_u.data.cpu()[i].item()
-            fOut.write((f'\n user id: {i} predicted {prediction} instead of {true_label}').encode('utf-8'))
-
+    ResultsWriter(os.path.join(current_dir, "output_twitter"), run_name).write(idx_test_u, y_test_u, x_test_u, metrics_test,
+                                                                               dict(params, trained_epochs=trainer.epoch))
 
     return (f1_micro_test_u, f1_macro_test_u)
 
-def exec_train(network_type_in, dim_in, treshold_dim=-1):
-    global network_type, dim, treshold
-    network_type = network_type_in
-    dim = dim_in
-    treshold = treshold_dim
-
+def split_validation(idx_train, val_percent, seed):
+    """Hold out a random val_percent share of the training users for validation"""
+    generator = torch.Generator().manual_seed(seed)
+    idx_train = idx_train[torch.randperm(len(idx_train), generator=generator).to(idx_train.device)]
+    val_num = int(round(len(idx_train) * val_percent))
+    return idx_train[val_num:].sort().values, idx_train[:val_num].sort().values
+
+def exec_train(network_type, dim, treshold=-1, seed=0, lr=0.01, weight_decay=5e-4,
+               type_att_size=64, type_fusion='att', hid_layer_dim=(64,32,16,8), epochs=250,
+               val_percent=0.0, val_interval=1, patience=0, checkpoint_interval=0, resume=False):
+    """Train and test HGCN on one Twitter graph and feature set; seed is the seed of the
+    first run, and the f1 scores of the last run are returned with its time. The dataset has
+    no validation split: val_percent > 0 holds out that share of the training users to
+    evaluate every val_interval epochs, and patience > 0 stops early on their f1.
+    checkpoint_interval > 0 saves the training state every checkpoint_interval epochs
+    and resume continues the run from its last checkpoint"""
     cuda = True # Enables CUDA training.
-    lr = 0.01 # Initial learning rate.c
-    weight_decay = 5e-4 # Weight decay (L2 loss on parameters).
-    type_att_size = 64 # type attention parameter dimension
-    type_fusion = 'att' # mean
-
+    # lr: Initial learning rate.
+    # weight_decay: Weight decay (L2 loss on parameters).
+    # type_att_size: type attention parameter dimension
+    # type_fusion: 'att' or 'mean'
+    fuse_proj = True # one projection matmul per source node type in each layer
+    packed = True # keep the hidden states of all node types in one tensor between layers
+    log_attention = False # collect the mean type attention of every layer and node type
+    att_log_interval = 50 # forward passes between two attention flushes
+    grad_checkpoint = False # recompute the activations of every layer in backward instead of storing them
+    precompute_prop = True # compute A_k x_k of the fixed input features once and reuse it in the first layer
+    prune = True # compute only the rows of every layer the training loss depends on
+    batch_size = 0 # > 0 trains on neighbor-sampled mini-batches of labelled users
+    fanout = 10 # neighbors sampled per node and relation in every layer
+    sign_hops = 0 # > 0 appends the features propagated up to sign_hops relation hops (SIGN-style) to the inputs
+    log_interval = 1 # epochs between two prints of the training loss and f1
+
+    first_seed = seed
     run_num = 1
     for run in range(run_num):
         t_start = time.time()
-        seed = run
+        seed = first_seed + run
 
         np.random.seed(seed)
         torch.manual_seed(seed)
@@ -113,12 +94,20 @@ def exec_train(network_type_in, dim_in, treshold_dim=-1):
         print('type fusion: ', type_fusion)
         print('type att size: ', type_att_size)
 
-        hid_layer_dim = [64,32,16,8]  # imdb3228
-        epochs = 250
+        hid_layer_dim = list(hid_layer_dim)  # imdb3228
+
+        # every parameter the results depend on: it names the files of the run
+        params = {'network_type': network_type, 'dim': dim, 'treshold': treshold, 'seed': seed, 'lr': lr,
+                  'weight_decay': weight_decay, 'type_att_size': type_att_size, 'type_fusion': type_fusion,
+                  'hid_layer_dim': hid_layer_dim, 'epochs': epochs, 'val_percent': val_percent,
+                  'val_interval': val_interval, 'patience': patience, 'batch_size': batch_size, 'fanout': fanout,
+                  'sign_hops': sign_hops}
 
-        global label, ft_dict, adj_dict
         label, ft_dict, adj_dict = load_twitter(network_type, dim, treshold)
 
+        if sign_hops > 0:
+            ft_dict = sign_features(ft_dict, adj_dict, sign_hops)
+
         output_layer_shape = dict.fromkeys(ft_dict.keys(), 2)
 
         layer_shape = []
@@ -129,20 +118,28 @@ def exec_train(network_type_in, dim_in, treshold_dim=-1):
         layer_shape.append(output_layer_shape)
 
         # Model and optimizer
-        net_schema = dict([(k, list(adj_dict[k].keys())) for k in adj_dict.keys()])
+        net_schema = build_net_schema(adj_dict)
 
-        global model
         model = HGCN(
             net_schema=net_schema,
             layer_shape=layer_shape,
             label_keys=list(label.keys()),
             type_fusion=type_fusion,
             type_att_size=type_att_size,
+            fuse_proj=fuse_proj,
+            grad_checkpoint=grad_checkpoint,
+            packed=packed,
         )
 
-        global optimizer
         optimizer = optim.Adam(model.parameters(), lr=lr, weight_decay=weight_decay)
 
+        att_collector = None
+        if log_attention:
+            current_dir = os.path.dirname(os.path.abspath(__file__))
+            att_path = os.path.join(current_dir, 'output_twitter', 'attention_' + run_id(params) + '.jsonl')
+            att_collector = AttentionCollector(FileSink(att_path), interval=att_log_interval)
+        model.register_attention_collector(att_collector)
+
         if cuda and torch.cuda.is_available():
             model.cuda()
 
@@ -155,10 +152,44 @@ def exec_train(network_type_in, dim_in, treshold_dim=-1):
                 for i in range(len(label[k])):
                     label[k][i] = label[k][i].cuda()
 
-        for epoch in range(epochs):
-            train(epoch)
+        if precompute_prop:
+            model.bind(ft_dict, adj_dict)
+
+        idx_train_u, idx_val_u = label['u'][1], None
+        if val_percent > 0:
+            idx_train_u, idx_val_u = split_validation(idx_train_u, val_percent, seed)
 
-        (micro_f1, macro_f1) = test()
+        sampler = NeighborSampler(adj_dict, [fanout] * len(hid_layer_dim), seed) if batch_size > 0 else None
+
+        train_field = None
+        if prune:
+            input_nodes, blocks, first_nodes = receptive_field(adj_dict, 'u', idx_train_u, len(hid_layer_dim))
+            train_field = (slice_features(ft_dict, input_nodes), blocks_to(blocks, label['u'][0].device))
+            if precompute_prop:
+                # the first layer of the pruned forward reads its rows of the precomputed A_k x_k
+                train_field += (model.bound_rows(first_nodes),)
+
+        trainer = Trainer(model, optimizer, ft_dict, adj_dict, 'u', label['u'][0], idx_train_u, idx_val_u,
+                          train_field=train_field, sampler=sampler, batch_size=batch_size,
+                          val_interval=val_interval, patience=patience, log_interval=log_interval)
+        if checkpoint_interval > 0 or resume:
+            current_dir = os.path.dirname(os.path.abspath(__file__))
+            checkpoint_path = os.path.join(current_dir, 'output_twitter', 'checkpoints', run_id(params) + '.pt')
+            trainer.checkpointer = Checkpointer(checkpoint_path, checkpoint_interval)
+            if resume:
+                trainer.resume()
+        trainer.fit(epochs)
+
+        (micro_f1, macro_f1) = test(trainer, label, params)
+
+        if att_collector is not None:
+            att_collector.flush()
 
         t_end = time.time()
-        print('Total time: ', t_end - t_start)
\ No newline at end of file
+        print('Total time: ', t_end - t_start)
+
+    return {'micro_f1': float(micro_f1), 'macro_f1': float(macro_f1), 'time': t_end - t_start}
+
+def train_job(network_type, dim, treshold=-1, **params):
+    """exec_train for a sweep job: a dict of parameter names"""
+    return exec_train(network_type, dim, treshold, **params)
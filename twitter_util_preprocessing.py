@@ -3,6 +3,8 @@ import scipy.sparse as sp
 import scipy.io as sio
 import pickle
 import torch
+from hgcn_store import save_hgcn
+from util_twitter import twitter_features_path, twitter_graph_path
 import os
 from sklearn.feature_extraction.text import HashingVectorizer, TfidfTransformer
 from sklearn.manifold import TSNE
@@ -15,16 +17,58 @@ def row_normalize(mat):
     rowsum[rowsum == 0.] = 0.01
     return mat / rowsum
 
+def sp_mat_row_normalize(mx):
+    """Row-normalize sparse matrix"""
+    rowsum = np.array(mx.sum(1))
+    with np.errstate(divide='ignore'):
+        r_inv = np.power(rowsum, -1).flatten()
+    r_inv[np.isinf(r_inv)] = 0.
+    r_mat_inv = sp.diags(r_inv.astype(mx.dtype))
+    mx = r_mat_inv.dot(mx).tocsr()
+    mx.eliminate_zeros()
+    return mx
+
 def sp_coo_2_sp_tensor(sp_coo_mat):
     """Convert a scipy sparse matrix to a torch sparse tensor."""
+    sp_coo_mat = sp_coo_mat.tocoo()
     indices = torch.from_numpy(np.vstack((sp_coo_mat.row, sp_coo_mat.col)).astype(np.int64))
-    values = torch.from_numpy(sp_coo_mat.data)
+    values = torch.from_numpy(sp_coo_mat.data.astype(np.float32))
     shape = torch.Size(sp_coo_mat.shape)
-    return torch.sparse.FloatTensor(indices, values, shape)
-
-def load_twitter(network_type, dim, treshold=-1):
+    return torch.sparse_coo_tensor(indices, values, shape)
+
+def align_features(user_ids, embeddings, out=None):
+    """Write every embedding row at the rank of its user id in one float32 matrix.
+
+    user_ids and embeddings are lists of integer id arrays and of their embedding
+    matrices (train and test); out can be a preallocated matrix, e.g. a memmap.
+    """
+    sorted_ids = np.sort(np.concatenate([np.asarray(ids, dtype=np.int64) for ids in user_ids]))
+    if out is None:
+        out = np.empty((len(sorted_ids), embeddings[0].shape[1]), dtype=np.float32)
+    for ids, ft in zip(user_ids, embeddings):
+        out[np.searchsorted(sorted_ids, np.asarray(ids, dtype=np.int64))] = ft
+    return out
+
+def standardize_(features, chunk_size=65536):
+    """Z-score the columns of features in place, chunk by chunk, with float64 statistics"""
+    mean = np.zeros(features.shape[1])
+    for start in range(0, features.shape[0], chunk_size):
+        mean += features[start: start+chunk_size].sum(0, dtype=np.float64)
+    mean /= features.shape[0]
+    var = np.zeros(features.shape[1])
+    for start in range(0, features.shape[0], chunk_size):
+        var += np.square(features[start: start+chunk_size] - mean).sum(0)
+    std = np.sqrt(var / features.shape[0])
+    for start in range(0, features.shape[0], chunk_size):
+        chunk = features[start: start+chunk_size]
+        chunk -= mean.astype(features.dtype)
+        chunk /= std.astype(features.dtype)
+    return features
+
+def build_twitter_features(dim, memmap=False):
+    """Labels, splits and standardized user embeddings of dim, shared by every graph;
+    with memmap the feature matrix is assembled in a memory-mapped file"""
     current_dir = os.path.dirname(os.path.abspath(__file__))
-    path='twitter_dataset/'
 
     path_embeddings=os.path.join(current_dir, 'twitter_dataset/embedded_datasets/'+str(dim)+'_dim/')
     
@@ -37,27 +81,18 @@ def load_twitter(network_type, dim, treshold=-1):
     with open(path_embeddings+'test_embeddings_'+str(dim)+'.pkl', 'rb') as in_file:
         u_ft_test = pickle.load(in_file)
 
-    #join the train and test embeddings along with thier userIds    
-    full_features = np.column_stack((
-         np.concatenate((np.asarray(u_ft_train['userId']) , np.asarray(u_ft_test['userId']))), 
-         np.concatenate((np.asarray(u_ft_train['embeddings']) , np.asarray(u_ft_test['embeddings']))
-                        )))
-    
-    #sort the full features based on userIds
-    full_features = full_features[full_features[:,0].argsort()]
-
-    #remove the userIds from the full features, now we have the ordered embeddings
-    full_features = full_features[:,1:]
+    # place the train and test embeddings in the order of their userIds: the ids stay
+    # integers and every row is written once into the preallocated feature matrix
+    user_ids = [np.asarray(u_ft_train['userId']), np.asarray(u_ft_test['userId'])]
+    embeddings = [np.asarray(u_ft_train['embeddings']), np.asarray(u_ft_test['embeddings'])]
+    features_path = twitter_features_path(dim)
+    out = None
+    if memmap:
+        os.makedirs(features_path, exist_ok=True)
+        mmap_path = os.path.join(features_path, 'ft_u.tmp.npy')
+        out = np.lib.format.open_memmap(mmap_path, mode='w+', dtype=np.float32, shape=(sum(map(len, user_ids)), embeddings[0].shape[1]))
+    full_features = align_features(user_ids, embeddings, out)
 
-	# load the adjacency matrices, created during the preprocessing phase
-    file_path = os.path.join(current_dir, 'twitter_dataset', 'twitter_sp_uu_' +
-				str(treshold).replace(".","_") + '_' + network_type + '_adj_mats.pkl')
-    with open(file_path, 'rb') as in_file:
-        (sp_A_uu_sn) = pickle.load(in_file)
-
-    A_uu_sn = sp_A_uu_sn.tocsr()
-
-    current_dir = os.path.dirname(os.path.abspath(__file__))
     full_label_path = os.path.join(current_dir, 'twitter_dataset', 'full_label.csv')
     full_label = np.genfromtxt(full_label_path, delimiter=',', dtype=np.int32)
 
@@ -70,20 +105,31 @@ def load_twitter(network_type, dim, treshold=-1):
     label['u'] = [u_label, idx_train_u, idx_test_u]
 
     ft_dict = {}
-    u_ft_std = (full_features - full_features.mean(0)) / full_features.std(0)
     # ft_dict['u'] = torch.FloatTensor(full_features) da provare senza z_score
-    ft_dict['u'] = torch.FloatTensor(u_ft_std)
+    ft_dict['u'] = torch.from_numpy(standardize_(full_features))
 
-    adj_dict = {'u':{}}
-    adj_dict['u']['u'] = sp_coo_2_sp_tensor(sp.coo_matrix(row_normalize(A_uu_sn)))
+    print('features dump: ', features_path)
+    save_hgcn(features_path, label, ft_dict, {})
+    if memmap:
+        del ft_dict, full_features, out
+        os.remove(mmap_path)
 
-	# hgcn write
-	# Save Processed Data for Heterogeneous Graph Convolutional Networks (HGCN):
+def build_twitter_graph(network_type, treshold=-1):
+    """Row-normalized user adjacency of (network_type, treshold), shared by every dim"""
+    current_dir = os.path.dirname(os.path.abspath(__file__))
 
-    hgcn_path = os.path.join(current_dir, './twitter_dataset/twitter_hgcn_' + str(treshold).replace(".","_") + '_' + str(network_type) + '_' + str(dim)+'.pkl')
-    
-    print('hgcn dump: ', hgcn_path)
-    with open(hgcn_path, 'wb') as out_file:
-        adj_dict['u']['u'] = adj_dict['u']['u'].to_dense()
-     
-        pickle.dump((label, ft_dict, adj_dict), out_file)
\ No newline at end of file
+	# load the adjacency matrices, created during the preprocessing phase
+    file_path = os.path.join(current_dir, 'twitter_dataset', 'twitter_sp_uu_' +
+				str(treshold).replace(".","_") + '_' + network_type + '_adj_mats.pkl')
+    with open(file_path, 'rb') as in_file:
+        (sp_A_uu_sn) = pickle.load(in_file)
+
+    A_uu_sn = sp_A_uu_sn.tocsr()
+
+    adj_dict = {'u':{}}
+    # normalize by the diagonal of inverse row sums, without densifying the N x N user graph
+    adj_dict['u']['u'] = sp_coo_2_sp_tensor(sp_mat_row_normalize(A_uu_sn))
+
+    graph_path = twitter_graph_path(network_type, treshold)
+    print('graph dump: ', graph_path)
+    save_hgcn(graph_path, {}, {}, adj_dict)
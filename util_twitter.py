@@ -3,6 +3,7 @@ import scipy.sparse as sp
 import scipy.io as sio
 import pickle
 import torch
+from hgcn_store import compose_hgcn
 import os
 from sklearn.feature_extraction.text import HashingVectorizer, TfidfTransformer
 
@@ -19,13 +20,19 @@ def sp_coo_2_sp_tensor(sp_coo_mat):
     shape = torch.Size(sp_coo_mat.shape)
     return torch.sparse.FloatTensor(indices, values, shape)
 
-def load_twitter(network_type, dim, treshold):
+def twitter_graph_path(network_type, treshold):
+	current_dir = os.path.dirname(os.path.abspath(__file__))
+	return os.path.join(current_dir, 'twitter_dataset', 'twitter_graph_' + str(treshold).replace(".","_") + '_' + str(network_type))
+
+def twitter_features_path(dim):
 	current_dir = os.path.dirname(os.path.abspath(__file__))
-	twitter_path = os.path.join(current_dir, 'twitter_dataset','twitter_hgcn_'+
-        str(treshold).replace(".","_") + '_' + str(network_type) + '_' + str(dim) + '.pkl')
-	print('twitter load: ', twitter_path, '\n')
-	with open(twitter_path, 'rb') as in_file:
-		(label, uu_dict, adj_dict_uu) = pickle.load(in_file)
-		adj_dict_uu['u']['u'] = adj_dict_uu['u']['u'].to_sparse()
+	return os.path.join(current_dir, 'twitter_dataset', 'twitter_features_' + str(dim))
+
+def load_twitter(network_type, dim, treshold):
+	# the labels and features of dim and the user graph of (network_type, treshold) are built apart
+	features_path = twitter_features_path(dim)
+	graph_path = twitter_graph_path(network_type, treshold)
+	print('twitter load: ', features_path, graph_path, '\n')
+	(label, uu_dict, adj_dict_uu) = compose_hgcn(features_path, graph_path)
 
-	return label, uu_dict, adj_dict_uu
\ No newline at end of file
+	return label, uu_dict, adj_dict_uu
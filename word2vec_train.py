@@ -1,40 +1,85 @@
 import os
+import json
+from itertools import chain
+from concurrent.futures import ProcessPoolExecutor
 from gensim.models import Word2Vec
 import gensim
+import numpy as np
 import pandas as pd
-import pickle
 import logging  # Setting up the loggings to monitor gensim
 logging.basicConfig(format="%(levelname)s - %(asctime)s: %(message)s", datefmt= '%H:%M:%S', level=logging.INFO)
 
-def trainWord2Vec(dim):
+current_dir = os.path.dirname(os.path.abspath(__file__))
+models_dir = os.path.join(current_dir, 'twitter_dataset', 'word2vec_models')
+corpus_dir = os.path.join(models_dir, 'corpus')
+
+def w2v_model_path(dim):
+    return os.path.join(models_dir, 'word2vec_model_' + str(dim) + '.model')
+
+def buildCorpus():
+    """Tokenize train.csv once into the shared corpus of every Word2Vec model.
+
+    The corpus is stored as the int32 word ids of all the sentences one after the
+    other (tokens.npy), the offset of every sentence (offsets.npy) and the vocabulary
+    with its counts, in order of first appearance (vocab.json).
+    """
+    train_set_path = os.path.join(current_dir, 'twitter_dataset', 'train.csv')
+    train = pd.read_csv(train_set_path, sep=',', index_col=0).drop('index',axis=1).drop('label',axis=1)
+
+    sentences = train['text_cleaned'].str.split(" ")
+    lengths = sentences.str.len().to_numpy(dtype=np.int64)
+    ids, words = pd.factorize(np.fromiter(chain.from_iterable(sentences), dtype=object, count=lengths.sum()))
+
+    os.makedirs(corpus_dir, exist_ok=True)
+    np.save(os.path.join(corpus_dir, 'tokens.npy'), ids.astype(np.int32))
+    np.save(os.path.join(corpus_dir, 'offsets.npy'), np.concatenate(([0], np.cumsum(lengths))))
+    with open(os.path.join(corpus_dir, 'vocab.json'), 'w') as out_file:
+        json.dump({'words': list(words), 'counts': np.bincount(ids, minlength=len(words)).tolist()}, out_file)
+
+class MemmapCorpus:
+    """Iterable over the sentences of the corpus written by buildCorpus, read from the memory-mapped ids"""
+
+    def __init__(self, path=corpus_dir):
+        self.tokens = np.load(os.path.join(path, 'tokens.npy'), mmap_mode='r')
+        self.offsets = np.load(os.path.join(path, 'offsets.npy'))
+        with open(os.path.join(path, 'vocab.json')) as in_file:
+            vocab = json.load(in_file)
+        self.words = np.array(vocab['words'], dtype=object)
+        self.word_freq = dict(zip(vocab['words'], vocab['counts']))
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __iter__(self):
+        for start, end in zip(self.offsets[:-1], self.offsets[1:]):
+            yield self.words[self.tokens[start: end]].tolist()
+
+def trainWord2Vec(dim, workers=5):
     seed=123
     window=10
     min_count=0
     sg=1
-    workers=5 # see if we can increase it
     epochs = 10
 
-    current_dir = os.path.dirname(os.path.abspath(__file__))
-    train_set_path = os.path.join(current_dir, 'twitter_dataset', 'train.csv')
-    train = pd.read_csv(train_set_path, sep=',', index_col=0).drop('index',axis=1).drop('label',axis=1)
-
-    final_list = []
-    vect = train['text_cleaned']
-
-    for s in vect:
-        final_list.append(s.split(" "))
+    corpus = MemmapCorpus()
 
     w2v_model = Word2Vec(vector_size=dim, seed=seed, window=window,
                         min_count=min_count, sg=sg, workers=workers)
 
-    # vocabulary creation
-    # token_word = lista di token (lista di liste)
-    token_word = final_list
-    w2v_model.build_vocab(token_word, min_count=1)
+    # vocabulary creation from the shared word counts, without scanning the corpus again
+    w2v_model.build_vocab_from_freq(corpus.word_freq, corpus_count=len(corpus))
+    w2v_model.corpus_total_words = sum(corpus.word_freq.values())
     total_examples = w2v_model.corpus_count
 
-    w2v_model.train(token_word, total_examples=total_examples, epochs=epochs)
+    w2v_model.train(corpus, total_examples=total_examples, epochs=epochs)
+
+    w2v_model.save(w2v_model_path(dim))
 
-    w2v_path = os.path.join(current_dir, 'twitter_dataset', 'word2vec_models', 'word2vec_model_' + str(dim) + '.pkl')
-    with open(w2v_path, "wb") as fOut:
-        pickle.dump(w2v_model, fOut)
\ No newline at end of file
+def trainWord2Vecs(dims, total_workers=None):
+    """Train the Word2Vec model of every dimension concurrently, sharing total_workers
+    (all the cpus by default) training threads between them"""
+    total_workers = total_workers or os.cpu_count()
+    workers = max(1, total_workers // len(dims))
+    with ProcessPoolExecutor(len(dims)) as pool:
+        for future in [pool.submit(trainWord2Vec, dim, workers) for dim in dims]:
+            future.result()